@@ -0,0 +1,16 @@
+from core.database import Base, UTCDateTime
+from sqlalchemy import Column, Integer, String, Boolean
+from datetime import timezone, datetime
+
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+
+    # No foreign key to users: the trail must outlive the accounts it describes.
+    id = Column(Integer, primary_key=True, index=True)
+    action = Column(String, nullable=False, index=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    email = Column(String, nullable=True)
+    target_id = Column(Integer, nullable=True)
+    success = Column(Boolean, nullable=False, default=True)
+    created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
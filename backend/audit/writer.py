@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import insert
+from core.database import engine
+from core.config import settings
+from core.logging_config import logger
+from .models import AuditEvent
+
+
+_STOP = object()
+
+
+class AuditWriter:
+    """
+    Write-behind buffer for audit events.
+
+    Events are queued in memory and flushed as one multi-row INSERT once
+    `batch_size` events are pending or `flush_interval` seconds have passed
+    since the first pending event. When the buffer is full, `record` waits for
+    the flusher to catch up instead of dropping events.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_buffer: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, action: str, user_id: Optional[int] = None, email: Optional[str] = None,
+                     target_id: Optional[int] = None, success: bool = True) -> None:
+        """
+        Queue an audit event for the next flush.
+
+        Args:
+            action (str): Event name, e.g. "signin" or "password_update".
+            user_id (Optional[int]): Acting user, when known.
+            email (Optional[str]): Email the event refers to, when known.
+            target_id (Optional[int]): Affected row, e.g. the vault entry id.
+            success (bool): Whether the audited operation succeeded.
+        """
+        await self._queue.put({
+            "action": action,
+            "user_id": user_id,
+            "email": email,
+            "target_id": target_id,
+            "success": success,
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still buffered and stop the background flusher."""
+        if self._task is None:
+            await self._drain()
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self._write(batch)
+            if stopping:
+                await self._drain()
+                return
+
+    async def _drain(self) -> None:
+        batch = []
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is _STOP:
+                continue
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                await self._write(batch)
+                batch = []
+        if batch:
+            await self._write(batch)
+
+    async def _write(self, batch: list[dict]) -> None:
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(insert(AuditEvent).values(batch))
+        except Exception as e:
+            logger.error(f"[AUDIT] Failed to flush {len(batch)} audit events: {e}")
+
+
+audit_writer = AuditWriter(
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+    max_buffer=settings.AUDIT_BUFFER_SIZE,
+)
@@ -1,16 +1,28 @@
+from datetime import datetime, timezone
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, exists
 from fastapi.responses import JSONResponse
 from . import utils
 from . import models
 from . import schemas
 from core.logging_config import logger
-from core.custom_exceptions import UserAlreadyExists, InvalidCredentials
+from core.custom_exceptions import UserAlreadyExists, InvalidCredentials, SecondFactorRequired
+from core.database import insert
+from core import repository
+from core.tracing import traced
+from core.sharding import shard_router
 from . import email_service
+from . import totp
 from .otp_generator import generate_otp
 from .otp_mail import send_otp_email
+from audit.writer import audit_writer
+from .email_filter import email_filter
+from .revocation import revocation_index
+from .deletion import account_deleter
 
 
+@traced()
 async def request_otp(email: schemas.UserBase, db: AsyncSession) -> schemas.MessageResponse:
     """
     Request an OTP for the given email address.
@@ -38,6 +50,7 @@ async def request_otp(email: schemas.UserBase, db: AsyncSession) -> schemas.Mess
     return {"message": "OTP sent successfully!"}
 
 
+@traced()
 async def verify_otp(data: schemas.OtpVerify, db: AsyncSession) -> schemas.MessageResponse:
     """
     Verify the OTP sent to the user's email.
@@ -66,6 +79,7 @@ async def verify_otp(data: schemas.OtpVerify, db: AsyncSession) -> schemas.Messa
     return {"message": "OTP verified successfully!"}
 
 
+@traced()
 async def verify_update_pass(data: schemas.VerifyPass, db: AsyncSession) -> schemas.MessageResponse:
     logger.info(
         f"[VERIFY_UPDATE_PASS] Verifying OTP and updating password for {data.email}")
@@ -75,8 +89,8 @@ async def verify_update_pass(data: schemas.VerifyPass, db: AsyncSession) -> sche
     if not user:
         raise InvalidCredentials("Email not registered.")
 
-    # 2. Verify OTP (assuming you have an Otp model with code, email, expires_at, used)
-    try:
+    # 2. Verify OTP: an authenticator code needs no lookup; otherwise fall back to the emailed one
+    if not (user.totp_enabled and await totp.verify(user.totp_secret, user.id, data.otp)):
         query = select(models.Otp).where(
             models.Otp.email == data.email,
             models.Otp.otp == data.otp,
@@ -85,21 +99,21 @@ async def verify_update_pass(data: schemas.VerifyPass, db: AsyncSession) -> sche
         )
         result = await db.execute(query)
         otp_record = result.scalar_one_or_none()
-    except Exception:
-        raise InvalidCredentials("Invalid or expired OTP.")
-    # 3. Update password (hash it before saving)
-    hashed_password = utils.hash_password(data.new_password)
-    user.password = hashed_password
+        if otp_record is None:
+            raise InvalidCredentials("Invalid or expired OTP.")
+        otp_record.used = True
 
-    # 4. Mark OTP as used
-    otp_record.used = True
+    # 3. Update password (hash it before saving)
+    user.hashed_password = utils.hash_password(data.new_password)
 
-    # 5. Commit transaction
+    # 4. Commit transaction
     await db.commit()
+    await audit_writer.record("password_reset", user_id=user.id, email=data.email)
 
     return {"message": "Password updated successfully!"}
 
 
+@traced()
 async def get_user_by_email(db: AsyncSession, email: str) -> models.User:
     """
     Fetches user from the DB using email.
@@ -109,16 +123,39 @@ async def get_user_by_email(db: AsyncSession, email: str) -> models.User:
         email (str): email input.
 
     Returns:
-        models.User: Returns a User from the User table.
+        models.User: Returns a User from the User table, or None if the email is not registered.
+    """
+    if not email_filter.might_exist(email):
+        return None
+    return await repository.get_user_by_email(db, email)
+
+
+@traced()
+async def email_exists(db: AsyncSession, email: str) -> bool:
+    """
+    Checks whether an email is registered without loading the user row.
+
+    Args:
+        db (AsyncSession): DB session.
+        email (str): email input.
+
+    Returns:
+        bool: True if a user with this email exists.
     """
-    result = await db.execute(select(models.User).where(models.User.email == email))
-    return result.scalar_one_or_none()
+    if not email_filter.might_exist(email):
+        return False
+    return await db.scalar(select(exists().where(models.User.email == email)))
 
 
+@traced()
 async def create_user(db: AsyncSession, user: schemas.UserCreate) -> schemas.UserOut:
     """
     Creates a new user in the User table.
 
+    The existence check runs before the bcrypt hash so taken emails are rejected
+    cheaply; the INSERT itself uses ON CONFLICT DO NOTHING so a concurrent signup
+    for the same email is still caught in the same statement.
+
     Args:
         db (AsyncSession): DB session.
         user (schemas.UserCreate): Input request.
@@ -129,24 +166,29 @@ async def create_user(db: AsyncSession, user: schemas.UserCreate) -> schemas.Use
     Returns:
         schemas.UserOut: The user output schema.
     """
-    existing_user = await get_user_by_email(db, user.email)
-    if existing_user:
+    if await email_exists(db, user.email):
         raise UserAlreadyExists(f"Email {user.email} already exists.")
 
     logger.info(f"[CREATE_USER] Creating user: {user.email}")
 
     hashed_pw = utils.hash_password(user.password)
-    db_user = models.User(
-        email=user.email,
-        hashed_password=hashed_pw,
-        verified=True
+    query = (
+        insert(models.User)
+        .values(email=user.email, hashed_password=hashed_pw, verified=True,
+                shard=shard_router.assign(user.email))
+        .on_conflict_do_nothing(index_elements=[models.User.email])
+        .returning(models.User.id, models.User.email)
     )
-    db.add(db_user)
+    created = (await db.execute(query)).first()
     await db.commit()
-    await db.refresh(db_user)
-    return db_user
+    if created is None:
+        raise UserAlreadyExists(f"Email {user.email} already exists.")
 
+    email_filter.add(created.email)
+    return {"id": created.id, "email": created.email}
 
+
+@traced()
 async def login(db: AsyncSession, user: schemas.UserLogin) -> JSONResponse:
     """
     Check user login details and provide bearer token.
@@ -163,31 +205,221 @@ async def login(db: AsyncSession, user: schemas.UserLogin) -> JSONResponse:
     """
     logger.info(f"Login requested by {user.email}")
     existing_user = await get_user_by_email(db, user.email)
-    if not existing_user or not utils.verify_password(user.password, existing_user.hashed_password):
+    if existing_user and existing_user.deleted_at:
+        existing_user = None
+    verified, new_hash = (utils.verify_and_update_password(user.password, existing_user.hashed_password)
+                          if existing_user else (False, None))
+    if not verified:
+        await audit_writer.record("signin", user_id=existing_user.id if existing_user else None,
+                                  email=user.email, success=False)
         raise InvalidCredentials(
             "Invalid Credentials! Please check the details input.")
 
-    access_token = utils.create_access_token({"sub": user.email})
-    refresh_token = utils.create_refresh_token({"sub": user.email})
+    if existing_user.totp_enabled and not await verify_second_factor(db, existing_user, user.otp):
+        await audit_writer.record("signin", user_id=existing_user.id, email=user.email, success=False)
+        raise SecondFactorRequired()
+
+    if new_hash:
+        # The stored hash predates the current hashing policy; upgrade it while we have the password.
+        logger.info(f"[LOGIN] Rehashing password of {user.email} under the current policy")
+        existing_user.hashed_password = new_hash
+        await db.commit()
+
+    family = utils.new_token_id()
+    access_token = utils.create_access_token({"sub": user.email, "fid": family})
+    refresh_token = utils.create_refresh_token({"sub": user.email, "fid": family})
     logger.info(f"Login Successful by {user.email}")
+    await audit_writer.record("signin", user_id=existing_user.id, email=user.email)
 
     response = JSONResponse(content={
         "message": "Login successful",
         "access_token": access_token
     })
+    set_refresh_cookie(response, refresh_token)
+    return response
+
 
+@traced()
+async def verify_second_factor(db: AsyncSession, user: models.User, code: Optional[str]) -> bool:
+    """
+    Check a second factor code: an authenticator code first, then an emailed OTP as fallback.
+
+    Args:
+        db (AsyncSession): DB session, only used for the emailed OTP fallback.
+        user (models.User): User with TOTP enabled.
+        code (Optional[str]): Code sent by the client.
+
+    Returns:
+        bool: True if the code was accepted (an emailed OTP is marked used).
+    """
+    if not code:
+        return False
+    if await totp.verify(user.totp_secret, user.id, code):
+        return True
+    query = select(models.Otp).where(
+        models.Otp.email == user.email,
+        models.Otp.otp == code,
+        models.Otp.used == False,
+        models.Otp.expiration_time > utils.get_current_time()
+    )
+    otp_entry = (await db.execute(query)).scalars().first()
+    if not otp_entry:
+        return False
+    otp_entry.used = True
+    await db.commit()
+    return True
+
+
+@traced()
+async def enroll_totp(db: AsyncSession, user: models.User) -> schemas.TotpEnrollment:
+    """
+    Start TOTP enrollment with a fresh secret; it is enforced once confirmed with a code.
+
+    Raises:
+        UserAlreadyExists: If TOTP is already enabled for the user.
+    """
+    if user.totp_enabled:
+        raise UserAlreadyExists("TOTP is already enabled.")
+    secret = totp.generate_secret()
+    user.totp_secret = totp.encrypt_secret(secret, user.id)
+    await db.commit()
+    return {"secret": secret, "otpauth_uri": totp.provisioning_uri(secret, user.email)}
+
+
+@traced()
+async def confirm_totp(db: AsyncSession, user: models.User, code: str) -> schemas.MessageResponse:
+    """
+    Enable TOTP once the user proves their authenticator produces matching codes.
+
+    Raises:
+        InvalidCredentials: If no enrollment is pending or the code is wrong.
+    """
+    if not user.totp_secret or user.totp_enabled or not await totp.verify(user.totp_secret, user.id, code):
+        raise InvalidCredentials("Invalid TOTP code.")
+    user.totp_enabled = True
+    await db.commit()
+    await audit_writer.record("totp_enable", user_id=user.id, email=user.email)
+    return {"message": "Two-factor authentication enabled."}
+
+
+@traced()
+async def disable_totp(db: AsyncSession, user: models.User, code: str) -> schemas.MessageResponse:
+    """
+    Turn TOTP off; takes a current authenticator code or an emailed OTP.
+
+    Raises:
+        InvalidCredentials: If TOTP is not enabled or the code is wrong.
+    """
+    if not user.totp_enabled or not await verify_second_factor(db, user, code):
+        raise InvalidCredentials("Invalid TOTP code.")
+    user.totp_enabled = False
+    user.totp_secret = None
+    await db.commit()
+    await audit_writer.record("totp_disable", user_id=user.id, email=user.email)
+    return {"message": "Two-factor authentication disabled."}
+
+
+def set_refresh_cookie(response: JSONResponse, refresh_token: str) -> None:
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
         httponly=True,
         secure=True,
         samesite="Lax",
-        max_age=7 * 24 * 60 * 60,  # 7 days
+        max_age=int(utils.REFRESH_TOKEN_EXPIRE.total_seconds()),
     )
 
+
+@traced()
+async def refresh(db: AsyncSession, refresh_token: str) -> JSONResponse:
+    """
+    Rotate a refresh token and issue a new access token.
+
+    The presented token's jti is revoked as part of the rotation. Presenting a
+    token that was already rotated is treated as theft: the whole family is
+    revoked, so both the attacker and the legitimate client must sign in again.
+
+    Args:
+        db (AsyncSession): DB session.
+        refresh_token (str): The refresh token from the cookie.
+
+    Raises:
+        InvalidCredentials: If the token is invalid, revoked or reused.
+
+    Returns:
+        JSONResponse: The new access token, with the rotated refresh token as a cookie.
+    """
+    payload = utils.decode_token(refresh_token)
+    if not payload or payload.get("type") != "refresh" or "jti" not in payload or "fid" not in payload:
+        raise InvalidCredentials("Invalid token")
+
+    family = payload["fid"]
+    if await revocation_index.is_revoked(db, "family", family):
+        raise InvalidCredentials("Token family revoked")
+
+    expires_at = datetime.fromtimestamp(payload["exp"], timezone.utc)
+    if not await revocation_index.revoke(db, "token", payload["jti"], expires_at):
+        logger.warning(f"[REFRESH] Reused refresh token for {payload['sub']}, revoking family {family}")
+        await revocation_index.revoke(db, "family", family, utils.get_current_time() + utils.REFRESH_TOKEN_EXPIRE)
+        await audit_writer.record("refresh_token_reuse", email=payload["sub"], success=False)
+        raise InvalidCredentials("Refresh token reuse detected")
+
+    access_token = utils.create_access_token({"sub": payload["sub"], "fid": family})
+    response = JSONResponse(content={
+        "access_token": access_token,
+        "token_type": "bearer"
+    })
+    set_refresh_cookie(response, utils.create_refresh_token({"sub": payload["sub"], "fid": family}))
+    return response
+
+
+@traced()
+async def logout(db: AsyncSession, refresh_token: str) -> JSONResponse:
+    """
+    Revoke the token family of the presented refresh token.
+
+    Args:
+        db (AsyncSession): DB session.
+        refresh_token (str): The refresh token from the cookie.
+
+    Returns:
+        JSONResponse: Confirmation message, with the refresh cookie cleared.
+    """
+    payload = utils.decode_token(refresh_token) if refresh_token else None
+    if payload and payload.get("type") == "refresh" and "fid" in payload:
+        await revocation_index.revoke(db, "family", payload["fid"], utils.get_current_time() + utils.REFRESH_TOKEN_EXPIRE)
+    response = JSONResponse(content={"message": "Logged out"})
+    response.delete_cookie(key="refresh_token", httponly=True, secure=True, samesite="Lax")
     return response
 
 
+@traced()
+async def request_account_deletion(db: AsyncSession, user: models.User, data: schemas.AccountDelete) -> models.DeletionJob:
+    """
+    Confirm the user's credentials and queue the deletion of their account.
+
+    Args:
+        db (AsyncSession): DB session the user was loaded in.
+        user (models.User): The signed-in user.
+        data (schemas.AccountDelete): Current password, and a second factor code when TOTP is enabled.
+
+    Raises:
+        InvalidCredentials: If the password is wrong.
+        SecondFactorRequired: If TOTP is enabled and no valid code was given.
+
+    Returns:
+        models.DeletionJob: The queued or running job.
+    """
+    if not utils.verify_password(data.password, user.hashed_password):
+        raise InvalidCredentials("Invalid password.")
+    if user.totp_enabled and not await verify_second_factor(db, user, data.otp):
+        raise SecondFactorRequired()
+    job = await account_deleter.request(db, user)
+    logger.info(f"[ACCOUNT] Deletion of {user.email} queued as job {job.id}")
+    return job
+
+
+@traced()
 async def store_reset_token(user_id: int, token: str, db: AsyncSession) -> None:
     pass_db = models.PasswordToken(user_id=user_id, token=token, used=False)
     db.add(pass_db)
@@ -195,6 +427,7 @@ async def store_reset_token(user_id: int, token: str, db: AsyncSession) -> None:
     await db.refresh(pass_db)
 
 
+@traced()
 async def reset_pass(data: dict, db: AsyncSession) -> schemas.MessageResponse:
     """
     Reset the user password.
@@ -221,8 +454,7 @@ async def reset_pass(data: dict, db: AsyncSession) -> schemas.MessageResponse:
     if reset_entry.used:
         raise InvalidCredentials("Token already used.")
 
-    res = await db.execute(select(models.User).where(models.User.email == email))
-    user = res.scalar_one_or_none()
+    user = await repository.get_user_by_email(db, email)
     if not user:
         raise InvalidCredentials("User not found.")
 
@@ -231,9 +463,11 @@ async def reset_pass(data: dict, db: AsyncSession) -> schemas.MessageResponse:
     db.add(user)
     db.add(reset_entry)
     await db.commit()
+    await audit_writer.record("password_reset", user_id=user.id, email=email)
     return {"message": "Password changed successfully!"}
 
 
+@traced()
 async def send_mail(data: dict, db: AsyncSession) -> schemas.ResetTokenResponse:
     """
     Sends a reset password link to user mail.
@@ -251,4 +485,5 @@ async def send_mail(data: dict, db: AsyncSession) -> schemas.ResetTokenResponse:
         raise InvalidCredentials("User not found!")
     email_service.send_reset_email(to_email=data.email, token=res_token)
     await store_reset_token(user_id=user.id, token=res_token, db=db)
+    await audit_writer.record("password_reset_requested", user_id=user.id, email=data.email)
     return {"reset_token": res_token, "message": "Reset token stored In DB."}
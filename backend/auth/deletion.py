@@ -0,0 +1,196 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select, delete, update, exists, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from audit.writer import audit_writer
+from core.config import settings
+from core.database import AsyncSessionLocal, insert
+from core.logging_config import logger
+from core.sharding import shard_router
+from passwords.cache import vault_cache
+from passwords.models import VAULT_TABLES
+from passwords.notifications import vault_events
+from passwords.rebalance import delete_user_rows
+from . import models
+
+
+ACTIVE = ("queued", "running")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class AccountDeleter:
+    """
+    Background worker that deletes accounts without loading their rows.
+
+    A request only marks the user as deleted (which locks the account) and
+    records a job in `deletion_jobs`, so any worker can report on it and it
+    survives restarts. The worker then empties the user's vault tables on their
+    shard in chunks of `batch_size` rows, one transaction per chunk, removes
+    their reset tokens and emailed OTPs the same way and finally deletes the
+    user row. Nothing relies on ON DELETE CASCADE, which databases created
+    before it was declared don't have. Progress is saved after every chunk.
+
+    A worker claims a job with a conditional UPDATE before running it, so each
+    job runs once even when several workers queued it. `resume` queues the
+    jobs left behind by a restart: unclaimed ones, failed ones, and running ones
+    whose worker has not reported progress for `stale_after` seconds.
+    """
+
+    def __init__(self, batch_size: int, stale_after: float):
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def request(self, db: AsyncSession, user: models.User) -> models.DeletionJob:
+        """
+        Lock the account and queue its deletion; a repeated request returns the pending job.
+
+        Args:
+            db (AsyncSession): Session the user was loaded in.
+            user (models.User): Account to delete.
+
+        Returns:
+            models.DeletionJob: The queued or running job.
+        """
+        job = await db.scalar(select(models.DeletionJob).where(
+            models.DeletionJob.user_id == user.id, models.DeletionJob.status.in_(ACTIVE)))
+        if job is not None:
+            return job
+        if user.deleted_at is None:
+            user.deleted_at = _now()
+        job = models.DeletionJob(id=uuid.uuid4().hex, user_id=user.id, email=user.email, status="queued",
+                                 deleted={})
+        db.add(job)
+        await db.commit()
+        self._queue.put_nowait(job.id)
+        return job
+
+    async def get(self, db: AsyncSession, job_id: str) -> Optional[models.DeletionJob]:
+        return await db.get(models.DeletionJob, job_id)
+
+    def _claimable(self):
+        job = models.DeletionJob
+        return or_(job.status == "queued",
+                   and_(job.status == "running", job.updated_at < _now() - timedelta(seconds=self.stale_after)))
+
+    async def resume(self, db: AsyncSession) -> int:
+        """Queue the jobs that a restart left unfinished; returns how many."""
+        job = models.DeletionJob
+        # Users marked as deleted before jobs were stored get one, under a fixed id so
+        # that workers resuming at the same time agree on it.
+        legacy = select(models.User.id, models.User.email, models.User.deleted_at).where(
+            models.User.deleted_at.is_not(None),
+            ~exists().where(job.user_id == models.User.id, job.status != "done"))
+        for user_id, email, deleted_at in (await db.execute(legacy)).all():
+            await db.execute(insert(job).values(
+                id=f"user-{user_id}-{int(deleted_at.timestamp())}", user_id=user_id, email=email, status="queued", deleted={},
+                created_at=_now(), updated_at=_now(),
+            ).on_conflict_do_nothing(index_elements=[job.id]))
+        await db.execute(update(job).where(job.status == "failed").values(status="queued", error=None,
+                                                                          finished_at=None))
+        await db.commit()
+
+        pending = (await db.execute(select(job.id).where(self._claimable()).order_by(job.created_at))).scalars().all()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        return len(pending)
+
+    async def _claim(self, job_id: str) -> Optional[models.DeletionJob]:
+        async with AsyncSessionLocal() as db:
+            job = models.DeletionJob
+            result = await db.execute(update(job).where(job.id == job_id, self._claimable())
+                                      .values(status="running", updated_at=_now()))
+            await db.commit()
+            if result.rowcount != 1:
+                return None
+            return await db.get(job, job_id)
+
+    async def _save(self, job_id: str, **values) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(models.DeletionJob).where(models.DeletionJob.id == job_id)
+                             .values(updated_at=_now(), **values))
+            await db.commit()
+
+    async def _delete_otps(self, db: AsyncSession, email: str, count) -> None:
+        otp = models.Otp
+        while True:
+            chunk = select(otp.id).where(otp.email == email).limit(self.batch_size).scalar_subquery()
+            result = await db.execute(delete(otp).where(otp.id.in_(chunk)))
+            await db.commit()
+            if result.rowcount == 0:
+                return
+            await count(otp.__tablename__, result.rowcount)
+
+    async def _delete(self, job: models.DeletionJob) -> None:
+        deleted = dict(job.deleted)
+
+        async def count(table: str, rows: int) -> None:
+            deleted[table] = deleted.get(table, 0) + rows
+            await self._save(job.id, deleted=dict(deleted))
+
+        while True:
+            async with AsyncSessionLocal() as db:
+                user = await db.get(models.User, job.user_id)
+            if user is None or not user.vault_moving:
+                break
+            # Let a running shard move finish, so it can't copy the vault back afterwards.
+            await asyncio.sleep(settings.SHARD_MOVE_GRACE)
+
+        if user is not None:
+            async with shard_router.session_for(user) as vault_db:
+                for table in reversed(VAULT_TABLES):
+                    await delete_user_rows(vault_db, table, job.user_id, self.batch_size,
+                                           progress=lambda rows, name=table.name: count(name, rows))
+            async with AsyncSessionLocal() as db:
+                tokens = models.PasswordToken.__table__
+                await delete_user_rows(db, tokens, job.user_id, self.batch_size,
+                                       progress=lambda rows: count(tokens.name, rows))
+                await self._delete_otps(db, job.email, count)
+                await db.execute(delete(models.User).where(models.User.id == job.user_id))
+                await db.commit()
+            deleted[models.User.__tablename__] = deleted.get(models.User.__tablename__, 0) + 1
+
+        vault_cache.invalidate(job.user_id)
+        await vault_events.publish(job.user_id, "account_deleted", None)
+        await audit_writer.record("account_delete", user_id=job.user_id, email=job.email)
+        await self._save(job.id, status="done", deleted=deleted, finished_at=_now())
+        logger.info(f"[ACCOUNT] Deleted account {job.email}: {deleted}")
+
+    async def _run(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = None
+            try:
+                job = await self._claim(job_id)
+                if job is not None:
+                    await self._delete(job)
+            except Exception as e:
+                logger.error(f"[ACCOUNT] Deletion job {job_id} failed: {e}")
+                if job is not None:
+                    try:
+                        await self._save(job_id, status="failed", error=str(e), finished_at=_now())
+                    except Exception as save_error:
+                        logger.error(f"[ACCOUNT] Could not record the failure of job {job_id}: {save_error}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+account_deleter = AccountDeleter(batch_size=settings.ACCOUNT_DELETE_BATCH,
+                                 stale_after=settings.ACCOUNT_DELETE_STALE)
@@ -0,0 +1,52 @@
+from typing import Optional
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.bloom import BloomFilter
+from core.config import settings
+from core.logging_config import logger
+from . import models
+
+
+class RegisteredEmailFilter:
+    """
+    In-memory Bloom filter of registered emails.
+
+    Lets lookups for unknown emails return without touching the database. The
+    filter only knows about signups seen by this process since it was built, so
+    it must stay disabled when several workers accept signups.
+    """
+
+    def __init__(self, min_capacity: int, error_rate: float):
+        self.min_capacity = min_capacity
+        self.error_rate = error_rate
+        self._bloom: Optional[BloomFilter] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    async def rebuild(self, db: AsyncSession) -> None:
+        """Build a fresh filter from every email in the users table."""
+        total = await db.scalar(select(func.count(models.User.id)))
+        bloom = BloomFilter(max(total * 2, self.min_capacity), self.error_rate)
+        result = await db.stream_scalars(select(models.User.email).execution_options(yield_per=5000))
+        async for email in result:
+            bloom.add(email)
+        self._bloom = bloom
+        logger.info(f"[EMAIL_FILTER] Loaded {bloom.count} registered emails")
+
+    def add(self, email: str) -> None:
+        if self._bloom is not None:
+            self._bloom.add(email)
+
+    def might_exist(self, email: str) -> bool:
+        """Return False only when the email is certainly not registered."""
+        if self._bloom is None:
+            return True
+        return email in self._bloom
+
+
+email_filter = RegisteredEmailFilter(
+    min_capacity=settings.EMAIL_FILTER_CAPACITY,
+    error_rate=settings.EMAIL_FILTER_ERROR_RATE,
+)
@@ -0,0 +1,152 @@
+"""
+Password hashing policy calibrated to this host.
+
+Usage (from the backend directory):
+
+    python -m auth.hash_policy --target-ms 250 --output hash_policy.json
+
+benchmarks bcrypt and, when argon2-cffi is installed, Argon2id on the current
+machine, picks the most expensive settings whose hashing time stays within the
+target, and writes them as a policy file. `HASH_POLICY_FILE` points the app at
+that file; hashes made with other settings are upgraded on the next successful
+login.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from passlib.context import CryptContext
+from passlib.hash import bcrypt, argon2
+
+
+DEFAULT_POLICY = {"schemes": ["bcrypt"], "deprecated": "auto"}
+BCRYPT_ROUNDS = range(10, 17)
+ARGON2_MEMORY_KIB = (262144, 131072, 65536, 47104, 19456)
+ARGON2_MAX_TIME_COST = 10
+SAMPLE_PASSWORD = "Calibrate#Pa55word"
+
+
+def build_context(path: str) -> CryptContext:
+    """
+    Build the CryptContext from a policy file, falling back to plain bcrypt defaults.
+
+    Args:
+        path (str): Policy file written by this module.
+
+    Returns:
+        CryptContext: Context used for hashing and verifying passwords.
+    """
+    if not path or not os.path.exists(path):
+        return CryptContext(**DEFAULT_POLICY)
+    with open(path) as f:
+        policy = json.load(f)
+    return CryptContext(**policy["context"])
+
+
+def _measure_ms(handler, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        handler.hash(SAMPLE_PASSWORD)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target_ms: float, repeat: int) -> tuple[int, float]:
+    """Return the highest bcrypt cost within the target, with its measured time."""
+    chosen = (BCRYPT_ROUNDS[0], _measure_ms(bcrypt.using(rounds=BCRYPT_ROUNDS[0]), repeat))
+    for rounds in BCRYPT_ROUNDS[1:]:
+        elapsed = _measure_ms(bcrypt.using(rounds=rounds), repeat)
+        if elapsed > target_ms:
+            break
+        chosen = (rounds, elapsed)
+    return chosen
+
+
+def calibrate_argon2(target_ms: float, repeat: int, parallelism: int) -> tuple[dict, float] | None:
+    """
+    Return the Argon2id settings within the target, preferring more memory over more passes.
+
+    Returns None when argon2-cffi is not installed or even the cheapest setting is too slow.
+    """
+    if not argon2.has_backend():
+        return None
+    for memory_cost in ARGON2_MEMORY_KIB:
+        chosen = None
+        for time_cost in range(1, ARGON2_MAX_TIME_COST + 1):
+            handler = argon2.using(type="ID", memory_cost=memory_cost, rounds=time_cost, parallelism=parallelism)
+            elapsed = _measure_ms(handler, repeat)
+            if elapsed > target_ms:
+                break
+            chosen = ({"memory_cost": memory_cost, "rounds": time_cost, "parallelism": parallelism}, elapsed)
+        if chosen is not None:
+            return chosen
+    return None
+
+
+def calibrate(target_ms: float, scheme: str, repeat: int, parallelism: int) -> dict:
+    """
+    Benchmark the hashing schemes and build a policy.
+
+    Args:
+        target_ms (float): Per-hash latency budget in milliseconds.
+        scheme (str): "argon2", "bcrypt" or "auto" (Argon2id when available).
+        repeat (int): Hashes timed per candidate setting; the median is used.
+        parallelism (int): Argon2 lanes.
+
+    Returns:
+        dict: Policy with the CryptContext settings and the measurements behind them.
+    """
+    rounds, bcrypt_ms = calibrate_bcrypt(target_ms, repeat)
+    context = {
+        "schemes": ["bcrypt"],
+        "default": "bcrypt",
+        "deprecated": "auto",
+        "bcrypt__default_rounds": rounds,
+        "bcrypt__min_rounds": rounds,
+    }
+    measured = {"bcrypt": {"rounds": rounds, "ms": round(bcrypt_ms, 1)}}
+
+    argon2_result = calibrate_argon2(target_ms, repeat, parallelism) if scheme in ("argon2", "auto") else None
+    if scheme == "argon2" and argon2_result is None:
+        raise SystemExit("Argon2id unavailable (install argon2-cffi) or too slow for the target.")
+    if argon2_result is not None:
+        params, argon2_ms = argon2_result
+        context["schemes"] = ["argon2", "bcrypt"]
+        context["default"] = "argon2"
+        context["argon2__type"] = "ID"
+        context.update({f"argon2__{key}": value for key, value in params.items()})
+        measured["argon2"] = {**params, "ms": round(argon2_ms, 1)}
+
+    return {
+        "context": context,
+        "target_ms": target_ms,
+        "measured": measured,
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "calibrated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Calibrate the password hashing cost for this host.")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="Per-hash latency budget.")
+    parser.add_argument("--scheme", choices=["auto", "argon2", "bcrypt"], default="auto")
+    parser.add_argument("--repeat", type=int, default=3, help="Hashes timed per candidate setting.")
+    parser.add_argument("--parallelism", type=int, default=1, help="Argon2 lanes.")
+    parser.add_argument("--output", default="hash_policy.json")
+    args = parser.parse_args(argv)
+
+    policy = calibrate(args.target_ms, args.scheme, args.repeat, args.parallelism)
+    with open(args.output, "w") as f:
+        json.dump(policy, f, indent=2)
+    print(json.dumps(policy["measured"], indent=2))
+    print(f"Wrote {args.output} (default scheme: {policy['context']['default']})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,5 +1,5 @@
-from core.database import Base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from core.database import Base, UTCDateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, JSON
 from sqlalchemy.orm import relationship
 from enum import Enum
 from datetime import timezone, datetime, timedelta
@@ -16,13 +16,26 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), nullable=False,
+    created_at = Column(UTCDateTime, nullable=False,
                         default=lambda: datetime.now(timezone.utc))
-    updated_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(
+    updated_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(
         timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
-    reset_tokens = relationship("PasswordToken", back_populates="user")
-    passwords = relationship("Password", back_populates="user", cascade="all, delete-orphan")
+    # Dependent rows are removed by ON DELETE CASCADE in the database (see auth.deletion),
+    # never loaded and deleted one by one through these relationships.
+    reset_tokens = relationship("PasswordToken", back_populates="user", cascade="all, delete-orphan",
+                                passive_deletes=True)
+    # Vault rows live on the user's shard, which may be another database: query them
+    # through a session from core.sharding rather than lazy-loading them here.
+    passwords = relationship("Password", back_populates="user", cascade="all, delete-orphan",
+                             passive_deletes=True, lazy="raise")
     verified = Column(Boolean, nullable=False, default=False)
+    shard = Column(Integer, nullable=True)
+    vault_moving = Column(Boolean, nullable=False, default=False)
+    # AES-GCM encrypted base32 secret; set at enrollment, enforced once confirmed.
+    totp_secret = Column(String, nullable=True)
+    totp_enabled = Column(Boolean, nullable=False, default=False)
+    # Set when account deletion is requested; the account is unusable from then on.
+    deleted_at = Column(UTCDateTime, nullable=True)
 
 
 class Otp(Base):
@@ -30,7 +43,7 @@ class Otp(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     otp = Column(String, nullable=False)
-    expiration_time = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(minutes=5))
+    expiration_time = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(minutes=5))
     used = Column(Boolean, default=False)
     email = Column(String, nullable=False)
 
@@ -39,8 +52,34 @@ class PasswordToken(Base):
     __tablename__ = "password_reset_tokens"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     token = Column(String, unique=True, nullable=False)
-    expiration_time = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(minutes=30))
+    expiration_time = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc) + timedelta(minutes=30))
     used = Column(Boolean, default=False)
     user = relationship("User", back_populates="reset_tokens")
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    token_id = Column(String, unique=True, nullable=False)
+    expires_at = Column(UTCDateTime, nullable=False, index=True)
+    revoked_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class DeletionJob(Base):
+    __tablename__ = "deletion_jobs"
+
+    # No foreign key to users: the job reports on the account after it is gone.
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    email = Column(String, nullable=False)
+    # queued -> running -> done | failed; updated_at doubles as the worker's heartbeat.
+    status = Column(String, nullable=False, default="queued", index=True)
+    deleted = Column(JSON, nullable=False, default=dict)
+    error = Column(String, nullable=True)
+    created_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = Column(UTCDateTime, nullable=True)
@@ -0,0 +1,159 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.broadcast import broadcast
+from core.config import settings
+from core.cuckoo import CuckooFilter
+from core.database import AsyncSessionLocal, insert
+from core.logging_config import logger
+from . import models
+from . import utils
+
+
+CHANNEL = "token_revoked"
+
+
+class RevocationIndex:
+    """
+    In-memory index of revoked refresh tokens and token families.
+
+    Revocations are kept in cuckoo filters grouped by the day they expire, so a
+    whole day drops out at once when its tokens can no longer be used. A miss is
+    authoritative and costs no database round trip; a hit is confirmed against
+    the `revoked_tokens` table to rule out false positives. The table stays the
+    source of truth: the index is rebuilt from it at startup. New revocations
+    reach the other workers through the broadcast backend, and the table is
+    also polled for any they missed.
+    """
+
+    def __init__(self, bucket_seconds: int, bucket_capacity: int, sync_interval: float):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_capacity = bucket_capacity
+        self.sync_interval = sync_interval
+        self._buckets: dict[int, list[CuckooFilter]] = {}
+        self._last_id = 0
+        self._task: Optional[asyncio.Task] = None
+        broadcast.subscribe(CHANNEL, self._on_message)
+
+    def _add(self, kind: str, token_id: str, expires_at: datetime) -> None:
+        key = f"{kind}:{token_id}"
+        filters = self._buckets.setdefault(int(expires_at.timestamp()) // self.bucket_seconds, [])
+        if not filters or not filters[-1].add(key):
+            new_filter = CuckooFilter(self.bucket_capacity)
+            new_filter.add(key)
+            filters.append(new_filter)
+
+    def might_be_revoked(self, kind: str, token_id: str) -> bool:
+        key = f"{kind}:{token_id}"
+        return any(key in f for filters in self._buckets.values() for f in filters)
+
+    def prune(self) -> None:
+        """Drop buckets whose tokens have all expired."""
+        current = int(utils.get_current_time().timestamp()) // self.bucket_seconds
+        for bucket in [b for b in self._buckets if b < current]:
+            del self._buckets[bucket]
+
+    async def is_revoked(self, db: AsyncSession, kind: str, token_id: str) -> bool:
+        """
+        Check whether a token or family is revoked.
+
+        Args:
+            db (AsyncSession): DB session, only used to confirm an index hit.
+            kind (str): "token" for a refresh token jti, "family" for a token family.
+            token_id (str): The jti or family id.
+
+        Returns:
+            bool: True if a matching revocation exists.
+        """
+        if not self.might_be_revoked(kind, token_id):
+            return False
+        found = await db.scalar(
+            select(models.RevokedToken.id).where(models.RevokedToken.kind == kind,
+                                                 models.RevokedToken.token_id == token_id))
+        return found is not None
+
+    async def revoke(self, db: AsyncSession, kind: str, token_id: str, expires_at: datetime) -> bool:
+        """
+        Durably revoke a token or family and add it to the index.
+
+        Args:
+            db (AsyncSession): DB session.
+            kind (str): "token" or "family".
+            token_id (str): The jti or family id.
+            expires_at (datetime): When the revoked credential stops being valid anyway.
+
+        Returns:
+            bool: False if it was already revoked, which for a refresh token means it was reused.
+        """
+        query = (
+            insert(models.RevokedToken)
+            .values(kind=kind, token_id=token_id, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[models.RevokedToken.token_id])
+            .returning(models.RevokedToken.id)
+        )
+        inserted = (await db.execute(query)).scalar_one_or_none()
+        await db.commit()
+        self._add(kind, token_id, expires_at)
+        await broadcast.publish(CHANNEL, {"kind": kind, "token_id": token_id, "expires_at": expires_at.isoformat()})
+        return inserted is not None
+
+    def _on_message(self, message: dict) -> None:
+        if not self.might_be_revoked(message["kind"], message["token_id"]):
+            self._add(message["kind"], message["token_id"], datetime.fromisoformat(message["expires_at"]))
+
+    async def load(self, db: AsyncSession) -> None:
+        """Rebuild the index from every unexpired revocation."""
+        self._buckets.clear()
+        self._last_id = 0
+        await self.sync(db)
+        logger.info(f"[REVOCATION] Index loaded up to revocation id {self._last_id}")
+
+    async def sync(self, db: AsyncSession) -> None:
+        """Pick up revocations written since the last load or sync, e.g. by other workers."""
+        query = (
+            select(models.RevokedToken.id, models.RevokedToken.kind,
+                   models.RevokedToken.token_id, models.RevokedToken.expires_at)
+            .where(models.RevokedToken.id > self._last_id,
+                   models.RevokedToken.expires_at > utils.get_current_time())
+            .order_by(models.RevokedToken.id)
+        )
+        result = await db.stream(query.execution_options(yield_per=5000))
+        async for row in result:
+            if not self.might_be_revoked(row.kind, row.token_id):
+                self._add(row.kind, row.token_id, row.expires_at)
+            self._last_id = row.id
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.sync(db)
+                    await db.execute(delete(models.RevokedToken).where(
+                        models.RevokedToken.expires_at < utils.get_current_time()))
+                    await db.commit()
+                self.prune()
+            except Exception as e:
+                logger.error(f"[REVOCATION] Sync failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+revocation_index = RevocationIndex(
+    bucket_seconds=int(timedelta(days=1).total_seconds()),
+    bucket_capacity=settings.REVOCATION_BUCKET_CAPACITY,
+    sync_interval=settings.REVOCATION_SYNC_INTERVAL,
+)
@@ -5,7 +5,9 @@ from core.database import get_db
 from . import crud, schemas
 from . import utils
 from core.logging_config import logger
-from core.custom_exceptions import UserAlreadyExists, InvalidCredentials, PasswordPattern
+from core.custom_exceptions import UserAlreadyExists, InvalidCredentials, PasswordPattern, SecondFactorRequired
+from core.dependencies import get_current_user
+from .deletion import account_deleter
 from fastapi.responses import JSONResponse
 
 
@@ -137,6 +139,8 @@ async def user_login(user: schemas.UserLogin, db: AsyncSession = Depends(get_db)
     """
     try:
         return await crud.login(user=user, db=db)
+    except SecondFactorRequired as e:
+        raise HTTPException(status_code=401, detail=f"{e}")
     except InvalidCredentials as e:
         logger.warning(f"{e}")
         raise HTTPException(status_code=404, detail="Invalid Credentials.")
@@ -145,22 +149,109 @@ async def user_login(user: schemas.UserLogin, db: AsyncSession = Depends(get_db)
         raise HTTPException(status_code=500, detail="Failed to sign in user.")
 
 
+@router.post("/totp/enroll", response_model=schemas.TotpEnrollment)
+async def enroll_totp(db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    """
+    Start enrolling an authenticator app. The returned secret (or otpauth URI, as a
+    QR code) goes into the app; two-factor sign-in is enforced after `/totp/confirm`.
+    """
+    try:
+        return await crud.enroll_totp(db, user)
+    except UserAlreadyExists as e:
+        raise HTTPException(status_code=409, detail=f"{e}")
+
+
+@router.post("/totp/confirm", response_model=schemas.MessageResponse)
+async def confirm_totp(data: schemas.TotpCode, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    """
+    Enable two-factor sign-in with a first code from the enrolled authenticator.
+    """
+    try:
+        return await crud.confirm_totp(db, user, data.code)
+    except InvalidCredentials as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
+
+
+@router.post("/totp/disable", response_model=schemas.MessageResponse)
+async def disable_totp(data: schemas.TotpCode, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    """
+    Disable two-factor sign-in; takes an authenticator code or, if the device is lost, an emailed OTP.
+    """
+    try:
+        return await crud.disable_totp(db, user, data.code)
+    except InvalidCredentials as e:
+        raise HTTPException(status_code=400, detail=f"{e}")
+
+
 @router.post("/refresh")
-async def refresh_token(request: Request):
+async def refresh_token(request: Request, db: AsyncSession = Depends(get_db)) -> JSONResponse:
+    """
+    Rotates the refresh token cookie and returns a new access token.
+
+    Args:
+        request (Request): Incoming request carrying the refresh token cookie.
+        db (AsyncSession): Database session. Defaults to Depends(get_db).
+
+    Raises:
+        HTTPException: 401 if the cookie is missing, 403 if the token is invalid, revoked or reused.
+
+    Returns:
+        JSONResponse: The new access token.
+    """
     refresh_token = request.cookies.get("refresh_token")
     if not refresh_token:
         raise HTTPException(status_code=401, detail="Refresh token missing")
 
-    payload = utils.decode_token(refresh_token)
-    if not payload or payload.get("type") != "refresh":
+    try:
+        return await crud.refresh(db=db, refresh_token=refresh_token)
+    except InvalidCredentials as e:
+        logger.warning(f"[REFRESH] {e}")
         raise HTTPException(status_code=403, detail="Invalid token")
 
-    access_token = utils.create_access_token({"sub": payload["sub"]})
 
-    return JSONResponse(content={
-        "access_token": access_token,
-        "token_type": "bearer"
-    })
+@router.post("/logout", response_model=schemas.MessageResponse)
+async def logout(request: Request, db: AsyncSession = Depends(get_db)) -> JSONResponse:
+    """
+    Revokes the refresh token family of this session and clears the cookie.
+
+    Args:
+        request (Request): Incoming request carrying the refresh token cookie.
+        db (AsyncSession): Database session. Defaults to Depends(get_db).
+
+    Returns:
+        JSONResponse: Confirmation message.
+    """
+    return await crud.logout(db=db, refresh_token=request.cookies.get("refresh_token"))
+
+
+@router.post("/delete-account", response_model=schemas.DeletionStatus, status_code=202)
+async def delete_account(data: schemas.AccountDelete, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    """
+    Queue the deletion of the current user's account and vault.
+
+    The account is locked straight away; the data is removed in the background.
+    Poll `/auth/delete-account/{job_id}` for progress: the job id is the only
+    handle on it, since the user's tokens stop working once deletion starts.
+    Jobs are stored in the database, so any worker can answer the poll and a
+    restart picks unfinished jobs up again.
+    """
+    try:
+        return await crud.request_account_deletion(db, user, data)
+    except SecondFactorRequired as e:
+        raise HTTPException(status_code=401, detail=f"{e}")
+    except InvalidCredentials as e:
+        raise HTTPException(status_code=403, detail=f"{e}")
+
+
+@router.get("/delete-account/{job_id}", response_model=schemas.DeletionStatus)
+async def account_deletion_status(job_id: str, db: AsyncSession = Depends(get_db)):
+    """
+    Report the progress of an account deletion: rows deleted per table, and completion.
+    """
+    job = await account_deleter.get(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
 
 
 @router.post('/forgot-password', response_model=schemas.ResetTokenResponse)
@@ -1,4 +1,6 @@
 import re
+from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
 
 
@@ -21,6 +23,7 @@ class UserCreate(UserBase):
 class UserLogin(BaseModel):
     email: EmailStr = Field(..., description="Give a valid email address")
     password: str = Field(..., min_length=8, max_length=40)
+    otp: Optional[str] = Field(None, description="Authenticator code, or an emailed OTP, when TOTP is enabled")
 
 
 class ForgotPassword(BaseModel):
@@ -87,3 +90,28 @@ class UserOut(UserBase):
     id: int
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class TotpCode(BaseModel):
+    code: str = Field(..., min_length=6, max_length=6, description="6-digit code from the authenticator app")
+
+
+class TotpEnrollment(BaseModel):
+    secret: str
+    otpauth_uri: str
+
+
+class AccountDelete(BaseModel):
+    password: str = Field(..., min_length=8, max_length=40)
+    otp: Optional[str] = Field(None, description="Authenticator code, or an emailed OTP, when TOTP is enabled")
+
+
+class DeletionStatus(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    status: str
+    deleted: dict[str, int]
+    created_at: datetime
+    finished_at: Optional[datetime]
+    error: Optional[str]
@@ -0,0 +1,134 @@
+"""
+Time-based one-time passwords (RFC 6238) as an optional second factor.
+
+Codes are computed from the user's secret and the clock, so checking one needs
+no database round trip. The secret is stored encrypted with AES-GCM under
+`TOTP_ENCRYPTION_KEY` (or a key derived from `SECRET_KEY`), bound to the user id.
+Each accepted time step is remembered in memory for as long as its code stays
+valid, and shared with the other workers through the broadcast backend, so a
+code cannot be used twice.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import time
+from urllib.parse import quote, urlencode
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from core.broadcast import broadcast
+from core.config import settings
+
+
+ISSUER = "Pass-Vault"
+DIGITS = 6
+STEP_SECONDS = 30
+CHANNEL = "totp_used"
+
+
+def _encryption_key() -> bytes:
+    if settings.TOTP_ENCRYPTION_KEY:
+        return base64.urlsafe_b64decode(settings.TOTP_ENCRYPTION_KEY)
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"pass-vault totp secret")
+    return hkdf.derive(settings.SECRET_KEY.encode())
+
+
+_aead = AESGCM(_encryption_key())
+
+
+def generate_secret() -> str:
+    """A fresh 160-bit secret, base32-encoded as authenticator apps expect."""
+    return base64.b32encode(os.urandom(20)).decode()
+
+
+def encrypt_secret(secret: str, user_id: int) -> str:
+    nonce = os.urandom(12)
+    ciphertext = _aead.encrypt(nonce, secret.encode(), str(user_id).encode())
+    return base64.b64encode(nonce + ciphertext).decode()
+
+
+def decrypt_secret(token: str, user_id: int) -> str:
+    data = base64.b64decode(token)
+    return _aead.decrypt(data[:12], data[12:], str(user_id).encode()).decode()
+
+
+def provisioning_uri(secret: str, email: str) -> str:
+    """otpauth:// URI to render as a QR code for authenticator apps."""
+    params = urlencode({"secret": secret, "issuer": ISSUER, "digits": DIGITS, "period": STEP_SECONDS})
+    return f"otpauth://totp/{quote(ISSUER)}:{quote(email)}?{params}"
+
+
+def code_at(secret: str, step: int) -> str:
+    key = base64.b32decode(secret)
+    digest = hmac.new(key, struct.pack(">Q", step), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack(">I", digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    return str(value % 10 ** DIGITS).zfill(DIGITS)
+
+
+class ReplayGuard:
+    """
+    Remembers the last time step accepted per user.
+
+    A code is only accepted for a step later than the last one used, which also
+    rules out replaying an older code still inside the drift window. Entries are
+    dropped once their step has left the window.
+    """
+
+    def __init__(self, drift_steps: int):
+        self.drift_steps = drift_steps
+        self._last_step: dict[int, int] = {}
+        self._pruned_at = 0
+        broadcast.subscribe(CHANNEL, self._on_message)
+
+    def allows(self, user_id: int, step: int) -> bool:
+        return step > self._last_step.get(user_id, -1)
+
+    async def record(self, user_id: int, step: int) -> None:
+        self._remember(user_id, step)
+        await broadcast.publish(CHANNEL, {"user_id": user_id, "step": step})
+
+    def _remember(self, user_id: int, step: int) -> None:
+        if step > self._last_step.get(user_id, -1):
+            self._last_step[user_id] = step
+        self._prune(int(time.time()) // STEP_SECONDS)
+
+    def _on_message(self, message: dict) -> None:
+        self._remember(message["user_id"], message["step"])
+
+    def _prune(self, now_step: int) -> None:
+        if now_step == self._pruned_at:
+            return
+        self._pruned_at = now_step
+        oldest = now_step - self.drift_steps
+        self._last_step = {user_id: step for user_id, step in self._last_step.items() if step >= oldest}
+
+
+replay_guard = ReplayGuard(drift_steps=settings.TOTP_DRIFT_STEPS)
+
+
+async def verify(encrypted_secret: str, user_id: int, code: str) -> bool:
+    """
+    Check a code against the current time step and `TOTP_DRIFT_STEPS` steps either side.
+
+    Args:
+        encrypted_secret (str): The user's stored secret.
+        user_id (int): Owner of the secret.
+        code (str): Code typed by the user.
+
+    Returns:
+        bool: True if the code is valid and has not been used before.
+    """
+    if not code or len(code) != DIGITS or not code.isdigit():
+        return False
+    secret = decrypt_secret(encrypted_secret, user_id)
+    now_step = int(time.time()) // STEP_SECONDS
+    for step in range(now_step - settings.TOTP_DRIFT_STEPS, now_step + settings.TOTP_DRIFT_STEPS + 1):
+        if hmac.compare_digest(code_at(secret, step), code):
+            if not replay_guard.allows(user_id, step):
+                return False
+            await replay_guard.record(user_id, step)
+            return True
+    return False
@@ -1,22 +1,34 @@
-from passlib.context import CryptContext
+import uuid
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
 from core.config import settings
 from fastapi import HTTPException
+from core.tracing import traced
+from .hash_policy import build_context
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = build_context(settings.HASH_POLICY_FILE)
 
+REFRESH_TOKEN_EXPIRE = timedelta(days=7)
 
+
+@traced("password.hash")
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 
+@traced("password.verify")
 def verify_password(password: str, hashed_password: str) -> bool:
     return pwd_context.verify(password, hashed_password)
 
 
+@traced("password.verify")
+def verify_and_update_password(password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    # Same cost as verify_password; the second item is a fresh hash when the stored one is outdated.
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=15))
@@ -24,10 +36,15 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 
+def new_token_id() -> str:
+    return uuid.uuid4().hex
+
+
 def create_refresh_token(data: dict, expires_delta: timedelta = None) -> str:
+    # Every refresh token gets its own jti; "fid" ties rotated tokens to the login that started the family.
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(days=7))
-    to_encode.update({"exp": expire, "type": "refresh"})
+    expire = datetime.now(timezone.utc) + (expires_delta or REFRESH_TOKEN_EXPIRE)
+    to_encode.update({"exp": expire, "type": "refresh", "jti": new_token_id()})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 
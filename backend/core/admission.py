@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Optional
+from .config import settings
+from .error_response import format_error
+from .logging_config import logger
+
+
+# Priority classes, served in this order when requests have to queue.
+VAULT_READ, DEFAULT, BULK = 0, 1, 2
+PRIORITY_NAMES = {VAULT_READ: "vault_read", DEFAULT: "default", BULK: "bulk"}
+# Share of ADMISSION_MAX_WAIT each class may spend queued before it is shed.
+MAX_WAIT_SHARE = {VAULT_READ: 1.0, DEFAULT: 0.5, BULK: 0.2}
+BULK_PATHS = ("/auth/request-otp", "/auth/signup", "/passwords/export")
+# Long-lived streams would pin a slot for their whole lifetime.
+EXEMPT_PATHS = ("/passwords/events",)
+# Streamed downloads give their slot back once the response starts, so transfer time
+# neither pins a slot nor feeds the latency gradient; at most `max_streams` of them
+# run at once, since each keeps a database cursor open until it is done.
+STREAMED_PATHS = ("/passwords/export",)
+
+
+def classify(scope) -> int:
+    """
+    Pick the priority class of a request from its method, path and headers.
+
+    Vault reads only need to carry a bearer token to be served first; the token is
+    verified later by the route, so a forged header buys queue position, not access.
+    """
+    path = scope["path"]
+    if path in BULK_PATHS:
+        return BULK
+    if scope["method"] == "GET" and path.startswith("/passwords/"):
+        for name, value in scope["headers"]:
+            if name == b"authorization" and value[:7].lower() == b"bearer ":
+                return VAULT_READ
+    return DEFAULT
+
+
+class GradientLimit:
+    """
+    Concurrency limit that follows observed latency (in the style of Netflix's Gradient2).
+
+    A short-term average of response latency is compared with a slowly moving
+    long-term baseline. While latency stays within `tolerance` times the baseline
+    the limit grows by roughly its square root per window; once requests start to
+    queue up inside the app and latency rises, the limit shrinks in proportion.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, tolerance: float = 2.0,
+                 smoothing: float = 0.2, window: int = 20, long_window: int = 600):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.window = window
+        self.long_alpha = 2 / (long_window + 1)
+        self.long_rtt: Optional[float] = None
+        self._samples: list[float] = []
+
+    def sample(self, rtt: float, inflight: int) -> None:
+        self._samples.append(rtt)
+        if len(self._samples) < self.window:
+            return
+        short_rtt = sum(self._samples) / len(self._samples)
+        self._samples.clear()
+
+        if self.long_rtt is None:
+            self.long_rtt = short_rtt
+        else:
+            self.long_rtt += self.long_alpha * (short_rtt - self.long_rtt)
+        if self.long_rtt > 2 * short_rtt:
+            # Load dropped off: let the baseline come back down quickly.
+            self.long_rtt *= 0.95
+        # Don't grow a limit the traffic isn't even reaching.
+        if inflight < self.limit / 2:
+            return
+
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / short_rtt))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+
+class _Waiter:
+    __slots__ = ("future",)
+
+    def __init__(self):
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    """
+    Admits requests up to the adaptive limit and queues the rest by priority.
+
+    A queued request waits at most its class's share of `max_wait`. When the
+    queue is full a newcomer displaces the lowest-priority waiter if it outranks
+    it, and is turned away otherwise. Turned-away requests are answered
+    straight away with 503 and a Retry-After estimate.
+    """
+
+    def __init__(self, limit: GradientLimit, queue_size: int, max_wait: float, max_streams: int):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.max_streams = max_streams
+        self.inflight = 0
+        self.streams = 0
+        self.shed = {name: 0 for name in PRIORITY_NAMES.values()}
+        self._queue: list[tuple[int, int, _Waiter]] = []
+        self._queued = 0
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int) -> bool:
+        """Take a slot, waiting in the queue if needed; returns False if the request is shed."""
+        if self.inflight < int(self.limit.limit) and not self._queued:
+            self.inflight += 1
+            return True
+        if self._queued >= self.queue_size and not self._displace(priority):
+            return False
+
+        if len(self._queue) > 2 * self.queue_size:
+            # Drop waiters that timed out or were displaced deep inside the heap.
+            self._queue = [entry for entry in self._queue if not entry[2].future.done()]
+            heapq.heapify(self._queue)
+        waiter = _Waiter()
+        heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+        self._queued += 1
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.max_wait * MAX_WAIT_SHARE[priority])
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                if waiter.future.result():
+                    self.release(None)
+            else:
+                waiter.future.cancel()
+                self._queued -= 1
+            raise
+        if not waiter.future.done():
+            waiter.future.cancel()
+            self._queued -= 1
+            return False
+        # True: a finishing request handed its slot over; False: displaced by a newcomer.
+        return waiter.future.result()
+
+    def release(self, rtt: Optional[float]) -> None:
+        if rtt is not None:
+            self.limit.sample(rtt, self.inflight)
+        self.inflight -= 1
+        while self._queue and self.inflight < int(self.limit.limit):
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue
+            self._queued -= 1
+            self.inflight += 1
+            waiter.future.set_result(True)
+
+    def _displace(self, priority: int) -> bool:
+        live = [entry for entry in self._queue if not entry[2].future.done()]
+        if not live:
+            return False
+        worst = max(live, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            return False
+        worst[2].future.set_result(False)
+        self._queued -= 1
+        return True
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained, at the observed latency."""
+        rtt = self.limit.long_rtt or 1.0
+        backlog = self.inflight + self._queued
+        return max(1, min(30, math.ceil(backlog * rtt / max(1.0, self.limit.limit))))
+
+    def summary(self) -> dict:
+        return {
+            "limit": round(self.limit.limit, 1),
+            "inflight": self.inflight,
+            "queued": self._queued,
+            "streams": self.streams,
+            "latency_ms": round(self.limit.long_rtt * 1000, 1) if self.limit.long_rtt else None,
+            "shed": dict(self.shed),
+        }
+
+
+admission = AdmissionController(
+    GradientLimit(settings.ADMISSION_INITIAL_LIMIT, settings.ADMISSION_MIN_LIMIT, settings.ADMISSION_MAX_LIMIT),
+    queue_size=settings.ADMISSION_QUEUE_SIZE,
+    max_wait=settings.ADMISSION_MAX_WAIT,
+    max_streams=settings.ADMISSION_MAX_STREAMS,
+)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware putting every HTTP request through the admission controller.
+
+    Latency is measured up to the start of the response, so streamed bodies don't
+    count as slow requests, while the slot is held until the body has been sent;
+    `STREAMED_PATHS` hand it back at the start of the response instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def _shed(self, scope, receive, send, priority: int):
+        admission.shed[PRIORITY_NAMES[priority]] += 1
+        logger.warning(f"[ADMISSION] Shed {scope['method']} {scope['path']} "
+                       f"(limit {admission.limit.limit:.0f}, queued {admission._queued}, "
+                       f"streams {admission.streams})")
+        response = format_error("Server is busy, please retry shortly.", 503)
+        response.headers["Retry-After"] = str(admission.retry_after())
+        return await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        priority = classify(scope)
+        streamed = scope["path"] in STREAMED_PATHS
+        if streamed:
+            if admission.streams >= admission.max_streams:
+                return await self._shed(scope, receive, send, priority)
+            admission.streams += 1
+        try:
+            if not await admission.acquire(priority):
+                return await self._shed(scope, receive, send, priority)
+
+            started = time.perf_counter()
+            rtt = None
+            released = False
+
+            async def send_and_time(message):
+                nonlocal rtt, released
+                if message["type"] == "http.response.start":
+                    rtt = time.perf_counter() - started
+                    if streamed:
+                        released = True
+                        admission.release(rtt)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_and_time)
+            finally:
+                if not released:
+                    admission.release(rtt)
+        finally:
+            if streamed:
+                admission.streams -= 1
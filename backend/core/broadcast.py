@@ -0,0 +1,90 @@
+import json
+from collections import defaultdict
+from typing import Callable
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncEngine
+from .config import settings
+from .database import engine
+from .logging_config import logger
+
+
+class Broadcast:
+    """
+    Delivers small JSON messages on named channels to every worker.
+
+    Listeners register with `subscribe` before `start` and are plain callables
+    run on the event loop for every message, including those published by the
+    same worker. This base class only reaches the current process.
+    """
+
+    def __init__(self):
+        self._listeners: dict[str, list[Callable[[dict], None]]] = defaultdict(list)
+
+    def subscribe(self, channel: str, listener: Callable[[dict], None]) -> None:
+        self._listeners[channel].append(listener)
+
+    def _dispatch(self, channel: str, message: dict) -> None:
+        for listener in self._listeners.get(channel, ()):
+            try:
+                listener(message)
+            except Exception as e:
+                logger.error(f"[BROADCAST] Listener on {channel} failed: {e}")
+
+    async def publish(self, channel: str, message: dict) -> None:
+        self._dispatch(channel, message)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class LocalBroadcast(Broadcast):
+    """In-process delivery, for single-worker deployments."""
+
+
+class PostgresBroadcast(Broadcast):
+    """Cross-worker delivery over Postgres LISTEN/NOTIFY on a dedicated connection."""
+
+    def __init__(self, db_engine: AsyncEngine):
+        super().__init__()
+        self.engine = db_engine
+        self._conn = None
+        self._pg = None
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        self._dispatch(channel, json.loads(payload))
+
+    async def start(self) -> None:
+        self._conn = await self.engine.connect()
+        raw = await self._conn.get_raw_connection()
+        self._pg = raw.driver_connection
+        for channel in self._listeners:
+            await self._pg.add_listener(channel, self._on_notify)
+
+    async def stop(self) -> None:
+        if self._conn is None:
+            return
+        for channel in self._listeners:
+            await self._pg.remove_listener(channel, self._on_notify)
+        await self._conn.close()
+        self._conn = self._pg = None
+
+    async def publish(self, channel: str, message: dict) -> None:
+        async with self.engine.connect() as conn:
+            await conn.execute(select(func.pg_notify(channel, json.dumps(message))))
+            await conn.commit()
+
+
+def create_broadcast(backend: str) -> Broadcast:
+    if backend == "postgres":
+        if engine.dialect.name == "postgresql":
+            return PostgresBroadcast(engine)
+        logger.warning(f"[BROADCAST] LISTEN/NOTIFY needs PostgreSQL, not {engine.dialect.name}; using local delivery")
+    elif backend != "local":
+        raise ValueError(f"Unknown broadcast backend: {backend}")
+    return LocalBroadcast()
+
+
+broadcast = create_broadcast(settings.BROADCAST_BACKEND)
@@ -11,6 +11,95 @@ class Settings(BaseSettings):
     EMAIL_FROM: str
     SMTP_PASSWORD: str
 
+    # Bring tables created by earlier releases up to date at startup (see core.upgrade)
+    SCHEMA_UPGRADE_ENABLED: bool = True
+
+    # Audit log write-behind buffer
+    AUDIT_BATCH_SIZE: int = 200
+    AUDIT_FLUSH_INTERVAL: float = 2.0
+    AUDIT_BUFFER_SIZE: int = 10000
+
+    # Bloom filter of registered emails; only safe with a single worker
+    EMAIL_FILTER_ENABLED: bool = False
+    EMAIL_FILTER_CAPACITY: int = 100000
+    EMAIL_FILTER_ERROR_RATE: float = 0.001
+
+    # Refresh-token revocation index
+    REVOCATION_BUCKET_CAPACITY: int = 4096
+    REVOCATION_SYNC_INTERVAL: float = 30.0
+
+    # Per-request query accounting and slow-query log
+    SLOW_QUERY_MS: float = 200.0
+    SLOW_QUERY_EXPLAIN: bool = True
+    QUERY_STATS_HEADERS: bool = False
+
+    # Emails of users allowed to use the internal/operator endpoints
+    ADMIN_EMAILS: list[str] = []
+
+    # On-demand sampling profiler
+    PROFILER_ENABLED: bool = False
+    PROFILER_SAMPLE_RATE: float = 0.0
+    PROFILER_INTERVAL_MS: float = 5.0
+    PROFILER_MAX_PROFILES: int = 50
+
+    # Extra vault shards; shard 0 is always DATABASE_URL
+    SHARD_URLS: list[str] = []
+    SHARD_VNODES: int = 64
+    SHARD_MOVE_GRACE: float = 2.0
+
+    # Vault entry version history retention (0 disables a rule)
+    VERSION_RETENTION_COUNT: int = 20
+    VERSION_RETENTION_DAYS: int = 90
+    VERSION_PRUNE_INTERVAL: float = 3600.0
+    VERSION_PRUNE_BATCH: int = 1000
+
+    # Cross-worker broadcast ("local" or "postgres") and vault change streams
+    BROADCAST_BACKEND: str = "local"
+    EVENTS_QUEUE_SIZE: int = 100
+    EVENTS_HEARTBEAT: float = 15.0
+
+    # SSL mode for PostgreSQL connections ("" to disable); ignored for SQLite
+    DATABASE_SSL: str = "require"
+    # asyncpg prepared statements kept per connection
+    DB_STATEMENT_CACHE_SIZE: int = 500
+
+    # Password hashing policy written by `python -m auth.hash_policy`
+    HASH_POLICY_FILE: str = "hash_policy.json"
+
+    # TOTP second factor; the secret key defaults to one derived from SECRET_KEY
+    TOTP_ENCRYPTION_KEY: str = ""
+    TOTP_DRIFT_STEPS: int = 1
+
+    # Request tracing; TRACING_EXPORTER is "stdout", "file", "none" or "package.module:Class"
+    TRACING_ENABLED: bool = False
+    TRACING_SAMPLE_RATE: float = 0.1
+    TRACING_EXPORTER: str = "stdout"
+    TRACING_FILE: str = "traces.jsonl"
+
+    # Rows removed per statement when deleting an account, and seconds without progress
+    # after which another worker may take over a running deletion
+    ACCOUNT_DELETE_BATCH: int = 1000
+    ACCOUNT_DELETE_STALE: float = 300.0
+
+    # Entries accepted per vault re-encryption request
+    VAULT_MIGRATION_BATCH: int = 500
+
+    # Per-user cache of serialized vault listings; with several workers, only safe
+    # when BROADCAST_BACKEND carries invalidations between them ("postgres")
+    VAULT_CACHE_ENABLED: bool = False
+    VAULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    VAULT_CACHE_TTL: float = 300.0
+
+    # Adaptive concurrency limit and load shedding
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_INITIAL_LIMIT: int = 20
+    ADMISSION_MIN_LIMIT: int = 4
+    ADMISSION_MAX_LIMIT: int = 200
+    ADMISSION_QUEUE_SIZE: int = 100
+    ADMISSION_MAX_WAIT: float = 2.0
+    # Vault exports streaming at once, per worker
+    ADMISSION_MAX_STREAMS: int = 4
+
     class Config:
         env_file = ".env"
 
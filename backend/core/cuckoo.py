@@ -0,0 +1,80 @@
+import hashlib
+import random
+from array import array
+from typing import Optional
+
+
+class CuckooFilter:
+    """
+    Cuckoo filter with 16-bit fingerprints and four slots per bucket.
+
+    Like a Bloom filter it has no false negatives and a small false positive
+    rate (about 8 / 2**16 per lookup when nearly full), at roughly two bytes per
+    item. Once an insert runs out of room the filter is marked `full` (that item
+    is still remembered) and later `add` calls return False without storing.
+    """
+
+    BUCKET_SIZE = 4
+    MAX_KICKS = 500
+
+    def __init__(self, capacity: int):
+        buckets = 1
+        while buckets * self.BUCKET_SIZE * 0.95 < capacity:
+            buckets <<= 1
+        self._mask = buckets - 1
+        self._slots = array("H", bytes(2 * buckets * self.BUCKET_SIZE))
+        self._victim: Optional[tuple[int, int]] = None
+        self.count = 0
+
+    def _fingerprint_and_index(self, item: str) -> tuple[int, int]:
+        h = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "little")
+        fingerprint = (h >> 48) or 1
+        return fingerprint, h & self._mask
+
+    def _alt_index(self, index: int, fingerprint: int) -> int:
+        return (index ^ (fingerprint * 0x5BD1E995)) & self._mask
+
+    def _bucket_has(self, index: int, fingerprint: int) -> bool:
+        start = index * self.BUCKET_SIZE
+        return fingerprint in self._slots[start:start + self.BUCKET_SIZE]
+
+    def _bucket_put(self, index: int, fingerprint: int) -> bool:
+        start = index * self.BUCKET_SIZE
+        for slot in range(start, start + self.BUCKET_SIZE):
+            if self._slots[slot] == 0:
+                self._slots[slot] = fingerprint
+                return True
+        return False
+
+    @property
+    def full(self) -> bool:
+        return self._victim is not None
+
+    def add(self, item: str) -> bool:
+        if self._victim is not None:
+            return False
+        fingerprint, i1 = self._fingerprint_and_index(item)
+        i2 = self._alt_index(i1, fingerprint)
+        self.count += 1
+        if self._bucket_put(i1, fingerprint) or self._bucket_put(i2, fingerprint):
+            return True
+
+        index = random.choice((i1, i2))
+        for _ in range(self.MAX_KICKS):
+            slot = index * self.BUCKET_SIZE + random.randrange(self.BUCKET_SIZE)
+            fingerprint, self._slots[slot] = self._slots[slot], fingerprint
+            index = self._alt_index(index, fingerprint)
+            if self._bucket_put(index, fingerprint):
+                return True
+        # Keep the evicted fingerprint so nothing added so far is forgotten.
+        self._victim = (index, fingerprint)
+        return True
+
+    def might_contain(self, item: str) -> bool:
+        fingerprint, i1 = self._fingerprint_and_index(item)
+        i2 = self._alt_index(i1, fingerprint)
+        if self._bucket_has(i1, fingerprint) or self._bucket_has(i2, fingerprint):
+            return True
+        return self._victim is not None and self._victim[1] == fingerprint and self._victim[0] in (i1, i2)
+
+    __contains__ = might_contain
@@ -36,3 +36,8 @@ class CartEmptyException(Exception):
 class OrderNotFoundException(Exception):
     def __init__(self, message="No order found"):
         super().__init__(message)
+
+
+class SecondFactorRequired(Exception):
+    def __init__(self, message="A valid second factor code is required."):
+        super().__init__(message)
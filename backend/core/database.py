@@ -1,19 +1,119 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from datetime import timezone
+from sqlalchemy import event, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.types import TypeDecorator
 from .config import settings
+from . import query_stats
+from . import tracing
 
 
 DATABASE_URL = settings.DATABASE_URL
 
-engine = create_async_engine(DATABASE_URL,
-                             connect_args={"ssl": "require"},)
+# Applied to every SQLite connection. WAL lets readers run alongside the single
+# writer; NORMAL sync is durable in WAL mode short of an OS crash.
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "busy_timeout": 5000,
+    "cache_size": -64000,
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+}
 
-AsyncSessionLocal = sessionmaker(
-    class_=AsyncSession, expire_on_commit=False, bind=engine)
+
+class UTCDateTime(TypeDecorator):
+    """
+    Timezone-aware timestamp that always comes back in UTC.
+
+    PostgreSQL stores the offset itself, but SQLite keeps the bare wall-clock
+    value and returns it naive, which then can't be compared with the aware
+    datetimes used everywhere else. Values are therefore stored as UTC and read
+    back with the UTC timezone attached, on every backend.
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+            if dialect.name == "sqlite":
+                value = value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+        return value
+
+
+def backend_of(url: str) -> str:
+    """Name of the database backend a URL points at: "postgresql" or "sqlite"."""
+    return make_url(url).get_backend_name()
+
+
+def _is_memory(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:" or "mode=memory" in str(url)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record, memory: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    if not memory:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_engine_for(url: str) -> AsyncEngine:
+    """
+    Create an instrumented async engine for one of the application's databases.
+
+    PostgreSQL URLs connect over SSL (`DATABASE_SSL`) and keep up to
+    `DB_STATEMENT_CACHE_SIZE` prepared statements per connection.
+    `sqlite+aiosqlite` URLs give an embedded database tuned with `SQLITE_PRAGMAS`;
+    an in-memory URL (`sqlite+aiosqlite://`) shares one connection so every
+    session sees the same data.
+    """
+    backend = backend_of(url)
+    if backend == "sqlite":
+        memory = _is_memory(url)
+        options = {"poolclass": StaticPool} if memory else {}
+        db_engine = create_async_engine(url, connect_args={"check_same_thread": False}, **options)
+        event.listen(db_engine.sync_engine, "connect",
+                     lambda conn, record: _set_sqlite_pragmas(conn, record, memory))
+    elif backend == "postgresql":
+        connect_args = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+        if settings.DATABASE_SSL:
+            connect_args["ssl"] = settings.DATABASE_SSL
+        db_engine = create_async_engine(url, connect_args=connect_args,)
+    else:
+        raise ValueError(f"Unsupported database backend: {backend}")
+    query_stats.install(db_engine.sync_engine)
+    tracing.install(db_engine.sync_engine)
+    return db_engine
+
+
+def create_sessionmaker(db_engine: AsyncEngine) -> sessionmaker:
+    return sessionmaker(class_=AsyncSession, expire_on_commit=False, bind=db_engine)
+
+
+engine = create_engine_for(DATABASE_URL)
+
+AsyncSessionLocal = create_sessionmaker(engine)
 
 Base = declarative_base()
 
+# INSERT construct of the primary database's dialect, for ON CONFLICT upserts;
+# PostgreSQL and SQLite spell them the same way.
+insert = sqlite.insert if backend_of(DATABASE_URL) == "sqlite" else postgresql.insert
+
 
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -2,10 +2,12 @@ from jose import JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException
-from sqlalchemy import select
-from auth import models
 from auth import utils
+from auth.revocation import revocation_index
 from .database import get_db
+from . import repository
+from .config import settings
+from .sharding import shard_router
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/signin")
@@ -14,12 +16,34 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/signin")
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     try:
         payload = utils.decode_token(token)
-        if payload is None:
+        if payload is None or payload.get("type") != "access":
             raise HTTPException(status_code=401, detail="Invalid token")
-        result = await db.execute(select(models.User).where(models.User.email == payload.get("sub")))
-        user = result.scalar_one_or_none()
+        if "fid" in payload and await revocation_index.is_revoked(db, "family", payload["fid"]):
+            raise HTTPException(status_code=401, detail="Token revoked")
+        user = await repository.get_user_by_email(db, payload.get("sub"))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        if user.deleted_at:
+            raise HTTPException(status_code=401, detail="Account is being deleted")
         return user
     except JWTError:
         raise HTTPException(status_code=404, detail="Invalid Token.")
+
+
+async def get_current_admin(user=Depends(get_current_user)):
+    if user.email not in settings.ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+
+async def get_vault_db(user=Depends(get_current_user)):
+    async with shard_router.session_for(user) as session:
+        yield session
+
+
+async def get_writable_vault_db(user=Depends(get_current_user)):
+    if user.vault_moving:
+        raise HTTPException(status_code=503, detail="Vault is being moved, retry shortly.",
+                            headers={"Retry-After": str(int(settings.SHARD_MOVE_GRACE) + 1)})
+    async with shard_router.session_for(user) as session:
+        yield session
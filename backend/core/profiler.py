@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Optional
+from auth.utils import decode_token
+from .config import settings
+from .logging_config import logger
+
+
+IDLE_FRAME = "<awaiting I/O>"
+
+
+class Profile:
+    """Folded call stacks sampled while one request was running."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, method: str, path: str):
+        self.id = next(self._ids)
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.duration_ms = 0.0
+        self.stacks: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stack: str) -> None:
+        with self._lock:
+            self.stacks[stack] += 1
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 2),
+            "samples": sum(self.stacks.values()),
+        }
+
+    def folded(self) -> str:
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def tree(self) -> dict:
+        """Stacks as a nested {name, value, children} tree, as used by d3-flame-graph."""
+        root = {"name": f"{self.method} {self.path}", "value": 0, "children": {}}
+        with self._lock:
+            items = list(self.stacks.items())
+        for stack, count in items:
+            node = root
+            node["value"] += count
+            for name in stack.split(";"):
+                node = node["children"].setdefault(name, {"name": name, "value": 0, "children": {}})
+                node["value"] += count
+
+        def finish(node):
+            node["children"] = [finish(child) for child in node["children"].values()]
+            return node
+
+        return finish(root)
+
+
+class SamplingProfiler:
+    """
+    Samples the event loop thread's Python stack while profiled requests run.
+
+    A request is attributed a sample only when its own task is the one running
+    on the loop, recognised by the task's outermost coroutine frame being on
+    the sampled stack, so concurrent requests do not bleed into each other;
+    samples taken while the task is suspended are recorded as `IDLE_FRAME`.
+    Finished profiles are kept in a bounded ring buffer.
+    """
+
+    def __init__(self, interval: float, max_profiles: int, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.profiles: deque[Profile] = deque(maxlen=max_profiles)
+        # Keyed by the frame of each profiled task's coroutine.
+        self._active: dict[object, Profile] = {}
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample_forever, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def begin(self, method: str, path: str) -> tuple[Profile, object]:
+        """Start profiling the current task; returns the profile and the key to pass to `end`."""
+        profile = Profile(method, path)
+        key = asyncio.current_task().get_coro().cr_frame
+        self._active[key] = profile
+        return profile, key
+
+    def end(self, profile: Profile, key, started: float) -> None:
+        self._active.pop(key, None)
+        profile.duration_ms = (time.perf_counter() - started) * 1000
+        self.profiles.append(profile)
+
+    def get(self, profile_id: int) -> Optional[Profile]:
+        return next((p for p in self.profiles if p.id == profile_id), None)
+
+    def _fold(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _running_profile(self, frame) -> Optional[Profile]:
+        """The profile whose task owns the stack ending in `frame`, if any."""
+        active = self._active.copy()
+        while frame is not None:
+            profile = active.get(frame)
+            if profile is not None:
+                return profile
+            frame = frame.f_back
+        return None
+
+    def _sample_forever(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if not self._active:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            profile = self._running_profile(frame)
+            if profile is not None:
+                profile.add(self._fold(frame))
+            else:
+                for waiting in list(self._active.values()):
+                    waiting.add(IDLE_FRAME)
+            del frame
+
+
+profiler = SamplingProfiler(
+    interval=settings.PROFILER_INTERVAL_MS / 1000,
+    max_profiles=settings.PROFILER_MAX_PROFILES,
+)
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware that profiles a request when an admin asks for it with the
+    `X-Profile` header, or at random for `PROFILER_SAMPLE_RATE` of requests.
+
+    Only installed when `PROFILER_ENABLED` is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wants_profile(self, scope) -> bool:
+        if settings.PROFILER_SAMPLE_RATE and random.random() < settings.PROFILER_SAMPLE_RATE:
+            return True
+        headers = dict(scope["headers"])
+        if b"x-profile" not in headers:
+            return False
+        scheme, _, token = headers.get(b"authorization", b"").decode().partition(" ")
+        payload = decode_token(token) if scheme.lower() == "bearer" else None
+        return bool(payload and payload.get("type") == "access" and payload.get("sub") in settings.ADMIN_EMAILS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profiler.start()
+        started = time.perf_counter()
+        profile, key = profiler.begin(scope["method"], scope["path"])
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(profile.id).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.end(profile, key, started)
+            logger.info(f"[PROFILER] Captured profile {profile.id} for {profile.method} {profile.path}")
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .config import settings
+from .logging_config import logger
+
+
+EXPLAIN_PREFIX = {
+    "postgresql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class QueryStats:
+    """Number of SQL statements and total time spent in the database for one unit of work."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements: list[str] = []
+
+    def add(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        self.statements.append(statement)
+
+    @property
+    def total_ms(self) -> float:
+        return self.total_time * 1000
+
+
+class LoopMonitor:
+    """
+    Keeps a running total of the time the event loop spent blocked.
+
+    With an async driver a statement's wall time also covers any stretch where
+    the loop was busy elsewhere, e.g. hashing a password, and could not pick up
+    the database's reply. A task that wakes every `interval` seconds adds up how
+    late each wake-up was; statement timings subtract the stalls that fell
+    inside them. Overlap between a stall and real database work is subtracted
+    too, so an adjusted time is a lower bound.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.stalled = 0.0
+        self._due: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def stalled_until(self, now: float) -> float:
+        """Total stall time up to `now`, including a wake-up that is overdue right now."""
+        if self._due is None or now <= self._due:
+            return self.stalled
+        return self.stalled + now - self._due
+
+    async def _run(self) -> None:
+        while True:
+            self._due = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.stalled += max(0.0, time.perf_counter() - self._due)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._due = None
+
+
+loop_monitor = LoopMonitor()
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+_budgets: list[QueryStats] = []
+
+
+def start_request() -> tuple[QueryStats, object]:
+    """Start collecting statements for the current request; returns the stats and a reset token."""
+    stats = QueryStats()
+    return stats, _current_stats.set(stats)
+
+
+def end_request(token) -> None:
+    _current_stats.reset(token)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return ""
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = now = time.perf_counter()
+    context._query_stalled = loop_monitor.stalled_until(now)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    now = time.perf_counter()
+    stalled = loop_monitor.stalled_until(now) - context._query_stalled
+    elapsed = max(0.0, now - context._query_started - stalled)
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(statement, elapsed)
+    for budget in _budgets:
+        budget.add(statement, elapsed)
+
+    if elapsed * 1000 < settings.SLOW_QUERY_MS:
+        return
+    plan = ""
+    if settings.SLOW_QUERY_EXPLAIN and not executemany:
+        try:
+            plan = _explain(conn, statement, parameters)
+        except Exception as e:
+            plan = f"<EXPLAIN failed: {e}>"
+    logger.warning(f"[SLOW_QUERY] {elapsed * 1000:.1f} ms: {statement}" + (f"\nPlan:\n{plan}" if plan else ""))
+
+
+def install(engine: Engine) -> None:
+    """Attach statement counting and slow-query logging to a (sync) engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def query_budget(max_queries: int):
+    """
+    Fail loudly if the enclosed block issues more than `max_queries` statements.
+
+    Counts every statement on every instrumented engine while the block runs, so it
+    also sees work done on the TestClient's event loop thread. Meant for tests:
+
+        with query_budget(3):
+            client.put(f"/passwords/{entry_id}", json=payload, headers=auth)
+
+    Raises:
+        AssertionError: If the budget is exceeded.
+    """
+    stats = QueryStats()
+    _budgets.append(stats)
+    try:
+        yield stats
+    finally:
+        _budgets.remove(stats)
+    if stats.count > max_queries:
+        listing = "\n".join(f"  {i + 1}. {s}" for i, s in enumerate(stats.statements))
+        raise AssertionError(f"Expected at most {max_queries} queries, got {stats.count}:\n{listing}")
@@ -0,0 +1,57 @@
+"""
+The hot queries of the request path, defined once.
+
+Each statement is a `lambda_stmt`: SQLAlchemy builds and compiles it on first
+use and afterwards only extracts the bound parameters from the lambda's
+closure, skipping construction of the select and computation of its cache key.
+The SQL text is identical on every call, so on PostgreSQL asyncpg's
+per-connection prepared statement cache (`DB_STATEMENT_CACHE_SIZE`) turns
+repeat calls into executions of an already prepared statement.
+
+`python -m core.query_bench` compares these with the statements built inline.
+"""
+from typing import Optional
+from sqlalchemy import select, func, lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth.models import User
+from passwords.models import Password, PasswordVersion, UserKey, SCHEMA_ENTRY_KEY
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    stmt = lambda_stmt(lambda: select(User).where(User.email == email))
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def list_passwords(db: AsyncSession, user_id: int) -> list[Password]:
+    stmt = lambda_stmt(lambda: select(Password).where(Password.user_id == user_id))
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def get_password(db: AsyncSession, password_id: int, user_id: int) -> Optional[Password]:
+    stmt = lambda_stmt(lambda: select(Password).where(Password.id == password_id, Password.user_id == user_id))
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def count_pending_entries(db: AsyncSession, user_id: int) -> int:
+    stmt = lambda_stmt(lambda: select(func.count()).select_from(Password).where(
+        Password.user_id == user_id, Password.schema_version == SCHEMA_ENTRY_KEY))
+    return (await db.execute(stmt)).scalar_one()
+
+
+async def list_versions(db: AsyncSession, password_id: int, user_id: int) -> list[PasswordVersion]:
+    stmt = lambda_stmt(lambda: select(PasswordVersion).where(
+        PasswordVersion.password_id == password_id, PasswordVersion.user_id == user_id,
+    ).order_by(PasswordVersion.id.desc()))
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def get_version(db: AsyncSession, version_id: int, password_id: int, user_id: int) -> Optional[PasswordVersion]:
+    stmt = lambda_stmt(lambda: select(PasswordVersion).where(
+        PasswordVersion.id == version_id, PasswordVersion.password_id == password_id,
+        PasswordVersion.user_id == user_id))
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def get_vault_key(db: AsyncSession, user_id: int) -> Optional[UserKey]:
+    stmt = lambda_stmt(lambda: select(UserKey).where(UserKey.user_id == user_id))
+    return (await db.execute(stmt)).scalar_one_or_none()
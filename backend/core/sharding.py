@@ -0,0 +1,104 @@
+import bisect
+import hashlib
+from sqlalchemy import MetaData, Table, Column, ForeignKey
+from sqlalchemy.ext.asyncio import AsyncSession
+from .config import settings
+from .upgrade import upgrade_schema
+from .database import engine, AsyncSessionLocal, DATABASE_URL, create_engine_for, create_sessionmaker
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class ShardRouter:
+    """
+    Maps users to the database holding their vault.
+
+    Shard 0 is always the primary database from `DATABASE_URL`; `SHARD_URLS`
+    adds shards 1..N. Placement is decided once, at signup, by a consistent-hash
+    ring over the email and stored in `users.shard`, which then acts as the
+    directory: adding shards never moves existing users implicitly, and the
+    rebalancing tool moves them by rewriting that column. Users created before
+    sharding have no shard recorded and live on shard 0.
+    """
+
+    def __init__(self, shard_urls: list[str], vnodes: int):
+        self.engines = [engine]
+        self.sessionmakers = [AsyncSessionLocal]
+        for url in shard_urls:
+            if url == DATABASE_URL:
+                continue
+            shard_engine = create_engine_for(url)
+            self.engines.append(shard_engine)
+            self.sessionmakers.append(create_sessionmaker(shard_engine))
+
+        points = sorted(
+            (_hash(f"shard-{shard}-vnode-{vnode}"), shard)
+            for shard in range(len(self.engines))
+            for vnode in range(vnodes)
+        )
+        self._ring_keys = [point for point, _ in points]
+        self._ring_shards = [shard for _, shard in points]
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.engines)
+
+    def assign(self, email: str) -> int:
+        """Pick the shard for a new user."""
+        if self.shard_count == 1:
+            return 0
+        index = bisect.bisect(self._ring_keys, _hash(email)) % len(self._ring_keys)
+        return self._ring_shards[index]
+
+    def shard_of(self, user) -> int:
+        return user.shard if user.shard is not None else 0
+
+    def session(self, shard: int) -> AsyncSession:
+        return self.sessionmakers[shard]()
+
+    def session_for(self, user) -> AsyncSession:
+        """Open a session on the shard that holds this user's vault."""
+        return self.session(self.shard_of(user))
+
+    async def create_tables(self, tables: list[Table], upgrade: bool = False) -> None:
+        """
+        Create the vault tables on every extra shard, upgrading existing ones first if asked.
+
+        Shards other than the primary do not have the users table, so foreign keys
+        pointing outside the vault tables are left out there.
+        """
+        metadata = _shard_metadata(tables)
+        for shard_engine in self.engines[1:]:
+            if upgrade:
+                await upgrade_schema(shard_engine, metadata)
+            async with shard_engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+
+    async def dispose(self) -> None:
+        for shard_engine in self.engines:
+            await shard_engine.dispose()
+
+
+def _shard_metadata(tables: list[Table]) -> MetaData:
+    metadata = MetaData()
+    names = {table.name for table in tables}
+    for table in tables:
+        columns = []
+        for column in table.columns:
+            foreign_keys = [
+                ForeignKey(fk.target_fullname, ondelete=fk.ondelete)
+                for fk in column.foreign_keys
+                if fk.column.table.name in names
+            ]
+            columns.append(Column(column.name, column.type, *foreign_keys,
+                                  primary_key=column.primary_key, nullable=column.nullable,
+                                  index=column.index, unique=column.unique,
+                                  server_default=column.server_default.arg if column.server_default is not None else None))
+        Table(table.name, metadata, *columns)
+    return metadata
+
+
+shard_router = ShardRouter(settings.SHARD_URLS, settings.SHARD_VNODES)
+
@@ -0,0 +1,333 @@
+"""
+Span-based request tracing.
+
+`TracingMiddleware` opens a root span per sampled request; `span` and `traced`
+open child spans under whatever span is current. The current span lives in a
+context variable, so tasks created while it is active inherit it and their
+spans join the same trace. SQL statements get spans through engine events,
+SMTP exchanges through `TracedSMTP`. When a root span ends, the whole trace is
+handed to the exporter chosen by `TRACING_EXPORTER`: "stdout", "file" (JSON
+lines in `TRACING_FILE`), "none", or a "package.module:Class" path to a custom
+`Exporter`. Outside a sampled request every helper here is a no-op.
+"""
+import functools
+import importlib
+import inspect
+import json
+import os
+import random
+import smtplib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .config import settings
+from .logging_config import logger
+
+
+MAX_STATEMENT_LENGTH = 500
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "attributes", "start_time", "_started",
+                 "duration_ms", "error")
+
+    def __init__(self, name: str, trace: "Trace", parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException) -> None:
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.trace.finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Collects the finished spans of one request and exports them when the root span ends."""
+
+    def __init__(self, exporter: "Exporter", trace_id: Optional[str] = None):
+        self.exporter = exporter
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.root: Optional[Span] = None
+        self.spans: list[Span] = []
+        self.exported = False
+
+    def finish(self, span: Span) -> None:
+        if self.exported:
+            # A task outlived the request; ship its span on its own.
+            self._export([span])
+        elif span is self.root:
+            self.exported = True
+            self._export(self.spans + [span])
+        else:
+            self.spans.append(span)
+
+    def _export(self, spans: list[Span]) -> None:
+        try:
+            self.exporter.export([s.to_dict() for s in spans])
+        except Exception as e:
+            logger.error(f"[TRACING] Export failed: {e}")
+
+
+class Exporter:
+    """Receives every finished trace as a list of span dicts, root span last."""
+
+    def export(self, spans: list[dict]) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class StdoutExporter(Exporter):
+    def export(self, spans: list[dict]) -> None:
+        sys.stdout.write("".join(json.dumps(span) + "\n" for span in spans))
+        sys.stdout.flush()
+
+
+class FileExporter(Exporter):
+    """Appends spans as JSON lines to a file, e.g. for jq or a later bulk upload."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[dict]) -> None:
+        with self._lock:
+            self._file.write("".join(json.dumps(span) + "\n" for span in spans))
+
+    def shutdown(self) -> None:
+        self._file.close()
+
+
+def create_exporter(name: str) -> Exporter:
+    if name == "stdout":
+        return StdoutExporter()
+    if name == "file":
+        return FileExporter(settings.TRACING_FILE)
+    if name == "none":
+        return Exporter()
+    module, _, cls = name.partition(":")
+    if not cls:
+        raise ValueError(f"Unknown tracing exporter: {name}")
+    return getattr(importlib.import_module(module), cls)()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class Tracer:
+    def __init__(self, exporter_name: str, sample_rate: float):
+        self.exporter_name = exporter_name
+        self.sample_rate = sample_rate
+        self._exporter: Optional[Exporter] = None
+
+    @property
+    def exporter(self) -> Exporter:
+        # Created with the first trace, so a disabled tracer never opens its file.
+        if self._exporter is None:
+            self._exporter = create_exporter(self.exporter_name)
+        return self._exporter
+
+    def shutdown(self) -> None:
+        if self._exporter is not None:
+            self._exporter.shutdown()
+            self._exporter = None
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+        """
+        Open the root span of a request, or return None when the request is not sampled.
+
+        An incoming W3C `traceparent` header keeps the caller's trace id and
+        sampling decision, so traces continue across services.
+        """
+        trace_id = parent_id = None
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16 and len(parts[3]) == 2:
+                try:
+                    sampled = int(parts[3], 16) & 1
+                except ValueError:
+                    sampled = None
+                if sampled == 0:
+                    return None
+                if sampled:
+                    trace_id, parent_id = parts[1], parts[2]
+        if trace_id is None and random.random() >= self.sample_rate:
+            return None
+        trace = Trace(self.exporter, trace_id)
+        trace.root = Span(name, trace, parent_id, attributes)
+        return trace.root
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time a block as a child of the current span; yields None outside a trace."""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        child = Span(name, parent.trace, parent.span_id, attributes)
+        token = _current_span.set(child)
+        try:
+            yield child
+        except BaseException as e:
+            child.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            child.end()
+
+    def traced(self, name: Optional[str] = None):
+        """Decorator wrapping every call of a function, sync or async, in a span."""
+        def decorator(fn):
+            span_name = name or f"{fn.__module__}.{fn.__name__}"
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(span_name):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+tracer = Tracer(settings.TRACING_EXPORTER, settings.TRACING_SAMPLE_RATE)
+span = tracer.span
+traced = tracer.traced
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is not None:
+        context._trace_span = Span("sql", parent.trace, parent.span_id, {
+            "db.system": conn.dialect.name,
+            "db.statement": statement[:MAX_STATEMENT_LENGTH],
+            "db.executemany": executemany,
+        })
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql_span = getattr(context, "_trace_span", None)
+    if sql_span is not None:
+        context._trace_span = None
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            sql_span.set_attribute("db.rowcount", cursor.rowcount)
+        sql_span.end()
+
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    sql_span = getattr(context, "_trace_span", None) if context is not None else None
+    if sql_span is not None:
+        context._trace_span = None
+        sql_span.record_error(exception_context.original_exception)
+        sql_span.end()
+
+
+def install(sync_engine: Engine) -> None:
+    """Trace every SQL statement run on an engine."""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class TracedSMTP(smtplib.SMTP):
+    """smtplib.SMTP with a span around each step of the exchange."""
+
+    def connect(self, host="localhost", port=0, source_address=None):
+        with span("smtp.connect", server=host, port=port):
+            return super().connect(host, port, source_address)
+
+    def starttls(self, *args, **kwargs):
+        with span("smtp.starttls"):
+            return super().starttls(*args, **kwargs)
+
+    def login(self, user, password, *, initial_response_ok=True):
+        with span("smtp.login"):
+            return super().login(user, password, initial_response_ok=initial_response_ok)
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        with span("smtp.sendmail"):
+            return super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+
+    def quit(self):
+        with span("smtp.quit"):
+            return super().quit()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the root span of each sampled request.
+
+    The trace id is returned in a `traceparent` response header so a slow
+    request seen by a client can be looked up in the exported spans.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        traceparent = headers.get(b"traceparent", b"").decode() or None
+        root = tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent,
+                                  **{"http.method": scope["method"], "http.path": scope["path"]})
+        if root is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                header = f"00-{root.trace.trace_id}-{root.span_id}-01".encode()
+                message["headers"] = list(message.get("headers", [])) + [(b"traceparent", header)]
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
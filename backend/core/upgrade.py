@@ -0,0 +1,193 @@
+from sqlalchemy import MetaData, Table, Column, inspect, literal
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateTable, CreateIndex, AddConstraint
+from .logging_config import logger
+
+
+# `create_all` only creates missing tables, so databases created before these changes
+# are brought up to date here. Every step checks the live schema first and is skipped
+# when it has already been applied, so running this on each startup is safe.
+
+# Columns added to tables that already existed.
+ADDED_COLUMNS = [
+    ("users", "shard"),
+    ("users", "vault_moving"),
+    ("users", "totp_secret"),
+    ("users", "totp_enabled"),
+    ("users", "deleted_at"),
+    ("passwords", "schema_version"),
+    ("password_versions", "schema_version"),
+]
+
+# Columns that used to be NOT NULL: data-key entries have no per-entry salt.
+NULLABLE_COLUMNS = [
+    ("passwords", "salt"),
+    ("password_versions", "salt"),
+]
+
+# Foreign keys that must cascade when the referenced row is deleted.
+CASCADE_KEYS = [
+    ("password_reset_tokens", "user_id"),
+    ("passwords", "user_id"),
+    ("password_versions", "password_id"),
+    ("password_versions", "user_id"),
+    ("user_keys", "user_id"),
+]
+
+# Serialises the upgrade between workers starting at the same time (PostgreSQL).
+_LOCK_KEY = 0x7061737376
+
+
+async def upgrade_schema(engine: AsyncEngine, metadata: MetaData) -> list[str]:
+    """
+    Bring the existing tables of one database in line with `metadata`.
+
+    Adds the columns in `ADDED_COLUMNS`, drops NOT NULL from `NULLABLE_COLUMNS`
+    and recreates the foreign keys in `CASCADE_KEYS` with ON DELETE CASCADE, for
+    the tables of `metadata` that exist. PostgreSQL gets ALTER TABLE statements,
+    run under an advisory lock. SQLite can't alter a column or constraint in
+    place, so tables needing either are rebuilt from `metadata` and their rows
+    copied over, with foreign key enforcement off for the duration.
+
+    Args:
+        engine (AsyncEngine): Database to upgrade.
+        metadata (MetaData): Target schema; for extra shards, their reduced copy.
+
+    Returns:
+        list[str]: The changes made, empty when the schema was already current.
+    """
+    async with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # The pragma is ignored inside a transaction, so it is switched before BEGIN.
+            await conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            try:
+                await conn.exec_driver_sql("BEGIN IMMEDIATE")
+                changes = await conn.run_sync(_upgrade, metadata)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+            finally:
+                await conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+                await conn.commit()
+        else:
+            await conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({_LOCK_KEY})")
+            changes = await conn.run_sync(_upgrade, metadata)
+            await conn.commit()
+    for change in changes:
+        logger.info(f"[SCHEMA] {engine.url.render_as_string()}: {change}")
+    return changes
+
+
+def _upgrade(conn: Connection, metadata: MetaData) -> list[str]:
+    changes = []
+    existing = set(inspect(conn).get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        changes += _add_columns(conn, table)
+        if conn.dialect.name == "sqlite":
+            changes += _rebuild_if_needed(conn, table)
+        else:
+            changes += _relax_nullability(conn, table)
+            changes += _cascade_foreign_keys(conn, table)
+        # Indexes declared since the table was created (e.g. on passwords.user_id).
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+    return changes
+
+
+def _add_columns(conn: Connection, table: Table) -> list[str]:
+    present = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    changes = []
+    for table_name, column_name in ADDED_COLUMNS:
+        if table_name != table.name or column_name in present:
+            continue
+        column = table.c[column_name]
+        conn.exec_driver_sql(f"ALTER TABLE {_quote_table(conn, table)} ADD COLUMN {_column_spec(conn, column)}")
+        changes.append(f"added {table.name}.{column.name}")
+    return changes
+
+
+def _column_spec(conn: Connection, column: Column) -> str:
+    spec = f"{conn.dialect.identifier_preparer.format_column(column)} {column.type.compile(dialect=conn.dialect)}"
+    if column.nullable:
+        return spec
+    # Existing rows need a value, so NOT NULL columns are added with their default.
+    if column.server_default is not None:
+        default = column.server_default.arg
+    else:
+        default = literal(column.default.arg, column.type).compile(
+            dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    return f"{spec} NOT NULL DEFAULT {default}"
+
+
+def _quote_table(conn: Connection, table: Table) -> str:
+    return conn.dialect.identifier_preparer.format_table(table)
+
+
+def _needs_null(conn: Connection, table: Table) -> list[str]:
+    live = {column["name"]: column for column in inspect(conn).get_columns(table.name)}
+    return [column_name for table_name, column_name in NULLABLE_COLUMNS
+            if table_name == table.name and column_name in live and not live[column_name]["nullable"]]
+
+
+def _needs_cascade(conn: Connection, table: Table) -> list[str]:
+    live = {tuple(fk["constrained_columns"]): fk for fk in inspect(conn).get_foreign_keys(table.name)}
+    missing = []
+    for table_name, column_name in CASCADE_KEYS:
+        # Extra shards leave out the keys that point at the primary database.
+        if table_name != table.name or not table.c[column_name].foreign_keys:
+            continue
+        fk = live.get((column_name,))
+        if fk is None or (fk.get("options", {}).get("ondelete") or "").upper() != "CASCADE":
+            missing.append(column_name)
+    return missing
+
+
+def _relax_nullability(conn: Connection, table: Table) -> list[str]:
+    changes = []
+    for column_name in _needs_null(conn, table):
+        column = conn.dialect.identifier_preparer.format_column(table.c[column_name])
+        conn.exec_driver_sql(f"ALTER TABLE {_quote_table(conn, table)} ALTER COLUMN {column} DROP NOT NULL")
+        changes.append(f"made {table.name}.{column_name} nullable")
+    return changes
+
+
+def _cascade_foreign_keys(conn: Connection, table: Table) -> list[str]:
+    missing = _needs_cascade(conn, table)
+    if not missing:
+        return []
+    live = {tuple(fk["constrained_columns"]): fk for fk in inspect(conn).get_foreign_keys(table.name)}
+    changes = []
+    for column_name in missing:
+        fk = live.get((column_name,))
+        if fk is not None:
+            name = conn.dialect.identifier_preparer.quote(fk["name"])
+            conn.exec_driver_sql(f"ALTER TABLE {_quote_table(conn, table)} DROP CONSTRAINT {name}")
+        for foreign_key in table.c[column_name].foreign_keys:
+            conn.execute(AddConstraint(foreign_key.constraint))
+        changes.append(f"made {table.name}.{column_name} cascade on delete")
+    return changes
+
+
+def _rebuild_if_needed(conn: Connection, table: Table) -> list[str]:
+    reasons = [f"made {table.name}.{name} nullable" for name in _needs_null(conn, table)]
+    reasons += [f"made {table.name}.{name} cascade on delete" for name in _needs_cascade(conn, table)]
+    if not reasons:
+        return []
+    # The documented SQLite procedure: create the new table under a temporary name,
+    # copy the rows, drop the old table and rename the new one into its place.
+    quoted = _quote_table(conn, table)
+    staging = conn.dialect.identifier_preparer.quote(f"_upgrade_{table.name}")
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {quoted} ", f"CREATE TABLE {staging} ", 1))
+    columns = ", ".join(conn.dialect.identifier_preparer.format_column(column) for column in table.columns)
+    conn.exec_driver_sql(f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {quoted}")
+    conn.exec_driver_sql(f"DROP TABLE {quoted}")
+    conn.exec_driver_sql(f"ALTER TABLE {staging} RENAME TO {quoted}")
+    violations = conn.exec_driver_sql(f"PRAGMA foreign_key_check({quoted})").fetchall()
+    if violations:
+        raise RuntimeError(f"Rows of {table.name} reference missing rows: {violations[:5]}")
+    return reasons
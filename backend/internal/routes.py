@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.params import Depends
+from fastapi.responses import PlainTextResponse
+from core.dependencies import get_current_admin
+from core.profiler import profiler
+from core.admission import admission
+
+
+router = APIRouter(prefix="/internal", tags=["Internal"], dependencies=[Depends(get_current_admin)])
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """
+    Route to list the most recent request profiles, newest first.
+    """
+    return [profile.summary() for profile in reversed(profiler.profiles)]
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: int, format: str = Query("tree", pattern="^(tree|folded)$")):
+    """
+    Route to get one profile as a flame-graph tree, or as folded stacks for flamegraph.pl/speedscope.
+    """
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return {**profile.summary(), "flamegraph": profile.tree()}
+
+
+@router.get("/admission")
+async def get_admission():
+    """
+    Route to inspect the adaptive concurrency limit, current load and shed counts.
+    """
+    return admission.summary()
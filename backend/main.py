@@ -1,5 +1,5 @@
 from contextlib import asynccontextmanager
-from core.database import engine, Base
+from core.database import engine, Base, AsyncSessionLocal
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.exceptions import RequestValidationError
 from fastapi.routing import APIRoute
@@ -9,17 +9,56 @@ from fastapi.middleware.cors import CORSMiddleware
 from auth.models import User
 from auth.routes import router as auth_router
 from passwords.routes import router as pass_router
+from internal.routes import router as internal_router
+from audit.writer import audit_writer
+from auth.email_filter import email_filter
+from auth.revocation import revocation_index
+from auth.deletion import account_deleter
 from core.error_response import format_error
 from core.logging_config import logger
 from core.dependencies import oauth2_scheme
 from core.config import settings
+from core import query_stats
+from core.profiler import profiler, ProfilerMiddleware
+from core.admission import AdmissionMiddleware
+from core.tracing import tracer, TracingMiddleware
+from core.sharding import shard_router
+from core.broadcast import broadcast
+from core.upgrade import upgrade_schema
+from passwords.models import VAULT_TABLES
+from passwords.versions import version_pruner
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    query_stats.loop_monitor.start()
+    if settings.SCHEMA_UPGRADE_ENABLED:
+        await upgrade_schema(engine, Base.metadata)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    yield
+    await shard_router.create_tables(VAULT_TABLES, upgrade=settings.SCHEMA_UPGRADE_ENABLED)
+    async with AsyncSessionLocal() as db:
+        await revocation_index.load(db)
+        await account_deleter.resume(db)
+        if settings.EMAIL_FILTER_ENABLED:
+            await email_filter.rebuild(db)
+    await broadcast.start()
+    audit_writer.start()
+    revocation_index.start()
+    version_pruner.start()
+    account_deleter.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        await account_deleter.stop()
+        await version_pruner.stop()
+        await revocation_index.stop()
+        await audit_writer.stop()
+        await broadcast.stop()
+        await shard_router.dispose()
+        tracer.shutdown()
+        await query_stats.loop_monitor.stop()
 
 
 origins = [f"{settings.URL}",
@@ -29,6 +68,10 @@ origins = [f"{settings.URL}",
 app = FastAPI(title="Pass-Vault", version="1.2", lifespan=lifespan)
 
 
+if settings.ADMISSION_ENABLED:
+    # Added before CORS so that shed requests still carry the CORS headers.
+    app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -37,6 +80,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.PROFILER_ENABLED:
+    # Added before the http middleware below so it runs inside the request's own task.
+    app.add_middleware(ProfilerMiddleware)
+
+
+@app.middleware("http")
+async def count_queries(request: Request, call_next):
+    stats, token = query_stats.start_request()
+    request.state.query_stats = stats
+    try:
+        response = await call_next(request)
+    finally:
+        query_stats.end_request(token)
+    logger.debug(f"[DB] {request.method} {request.url.path}: {stats.count} queries in {stats.total_ms:.1f} ms")
+    if settings.QUERY_STATS_HEADERS:
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{stats.total_ms:.1f}"
+    return response
+
+
+if settings.TRACING_ENABLED:
+    # Registered after the http middleware above so it is the outermost layer, and the
+    # root span includes call_next and the time queued for admission.
+    app.add_middleware(TracingMiddleware)
+
 
 @app.get("/")
 async def read_root():
@@ -44,6 +112,7 @@ async def read_root():
 
 app.include_router(auth_router)
 app.include_router(pass_router)
+app.include_router(internal_router)
 
 
 @app.exception_handler(Exception)
@@ -0,0 +1,190 @@
+"""
+Operator backup and restore for the vault tables: `user_keys`, `passwords` and
+its `password_versions` history. Entries of schema 2 can only be decrypted with
+the wrapped key from `user_keys`, so the three are always backed up together.
+
+Usage (from the backend directory):
+
+    python -m passwords.backup dump vault-snapshot.csv.gz [--shard N]
+    python -m passwords.backup restore vault-snapshot.csv.gz [--shard N] [--truncate]
+
+`dump` streams each table out with Postgres COPY straight into its own gzip
+file next to the snapshot path (`vault-snapshot.passwords.csv.gz`, ...) and
+writes a `<snapshot>.json` manifest holding each table's row count and the
+SHA-256 of its uncompressed stream. `restore` verifies every checksum before
+streaming the tables back in with COPY, in dependency order, inside a single
+transaction. Each shard is backed up separately; `--shard` defaults to 0, the
+primary database.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import sys
+from datetime import datetime, timezone
+from sqlalchemy import text
+from core.sharding import shard_router
+from core.logging_config import logger
+from passwords import models
+
+
+# In dependency order: a table only references the ones before it.
+TABLES = models.VAULT_TABLES
+CHUNK_SIZE = 1024 * 1024
+
+
+def _manifest_path(path: str) -> str:
+    return f"{path}.json"
+
+
+def _table_path(path: str, table: str) -> str:
+    base = path.removesuffix(".csv.gz")
+    return f"{base}.{table}.csv.gz"
+
+
+def _checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with gzip.open(path, "rb") as snapshot:
+        while chunk := snapshot.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _driver_connection(conn):
+    if conn.dialect.name != "postgresql":
+        raise SystemExit(f"COPY backups need PostgreSQL, not {conn.dialect.name}.")
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def _dump_table(pg, table, path: str) -> dict:
+    digest = hashlib.sha256()
+    columns = [column.name for column in table.columns]
+    with gzip.open(path, "wb") as snapshot:
+        async def write(chunk: bytes) -> None:
+            digest.update(chunk)
+            snapshot.write(chunk)
+
+        status = await pg.copy_from_table(table.name, columns=columns, output=write, format="csv")
+    return {
+        "table": table.name,
+        "path": path,
+        "columns": columns,
+        "rows": int(status.split()[-1]),
+        "sha256": digest.hexdigest(),
+    }
+
+
+async def dump(path: str, shard: int = 0) -> dict:
+    """
+    Stream every row of the vault tables into compressed snapshots.
+
+    The tables are read in one REPEATABLE READ transaction, so keys, entries and
+    versions come from the same point in time.
+
+    Args:
+        path (str): Snapshot path; each table is written next to it.
+        shard (int): Shard to back up.
+
+    Returns:
+        dict: The manifest written next to the snapshot.
+    """
+    async with shard_router.engines[shard].connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            pg = await _driver_connection(conn)
+            # Runs through SQLAlchemy first so the COPYs below share its snapshot.
+            await conn.execute(text("SET TRANSACTION READ ONLY"))
+            tables = [await _dump_table(pg, table, _table_path(path, table.name)) for table in TABLES]
+
+    manifest = {
+        "shard": shard,
+        "tables": tables,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(_manifest_path(path), "w") as f:
+        json.dump(manifest, f, indent=2)
+    rows = sum(table["rows"] for table in tables)
+    logger.info(f"[BACKUP] Dumped {rows} rows in {len(tables)} tables from shard {shard} to {path}")
+    return manifest
+
+
+async def _chunks(path: str):
+    with gzip.open(path, "rb") as snapshot:
+        while chunk := snapshot.read(CHUNK_SIZE):
+            yield chunk
+
+
+async def restore(path: str, shard: int = 0, truncate: bool = False) -> int:
+    """
+    Load a snapshot produced by `dump` back into the vault tables.
+
+    Args:
+        path (str): Snapshot path given to `dump`.
+        shard (int): Shard to load into.
+        truncate (bool): Empty the tables before loading.
+
+    Raises:
+        SystemExit: If a table's snapshot does not match its manifest.
+
+    Returns:
+        int: Number of restored rows.
+    """
+    with open(_manifest_path(path)) as f:
+        manifest = json.load(f)
+    # Snapshots from before key and history backups hold just the passwords table.
+    tables = manifest.get("tables") or [dict(manifest, path=path)]
+    for table in tables:
+        if _checksum(table["path"]) != table["sha256"]:
+            raise SystemExit(f"Checksum mismatch for {table['path']}, refusing to restore.")
+
+    names = ", ".join(table["table"] for table in tables)
+    rows = 0
+    async with shard_router.engines[shard].begin() as conn:
+        pg = await _driver_connection(conn)
+        # Runs through SQLAlchemy first so the COPY below joins the open transaction.
+        await conn.execute(text(f"LOCK TABLE {names} IN EXCLUSIVE MODE"))
+        if truncate:
+            # CASCADE also empties password_versions when an older, passwords-only
+            # snapshot is restored; its rows would reference entries being replaced.
+            # user_keys is left alone then, as that snapshot has no keys to put back.
+            await conn.execute(text(f"TRUNCATE {names} CASCADE"))
+        for table in tables:
+            name = table["table"]
+            status = await pg.copy_to_table(name, source=_chunks(table["path"]), columns=table["columns"],
+                                            format="csv")
+            await conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 1)) FROM {name}"))
+            rows += int(status.split()[-1])
+
+    logger.info(f"[BACKUP] Restored {rows} rows in {len(tables)} tables from {path}")
+    return rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Backup and restore the vault tables.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dump_cmd = commands.add_parser("dump", help="Write a compressed, checksummed snapshot.")
+    dump_cmd.add_argument("path")
+    dump_cmd.add_argument("--shard", type=int, default=0)
+    restore_cmd = commands.add_parser("restore", help="Load a snapshot written by dump.")
+    restore_cmd.add_argument("path")
+    restore_cmd.add_argument("--shard", type=int, default=0)
+    restore_cmd.add_argument("--truncate", action="store_true", help="Empty the tables first.")
+    args = parser.parse_args(argv)
+
+    async def run():
+        try:
+            if args.command == "dump":
+                await dump(args.path, shard=args.shard)
+            else:
+                await restore(args.path, shard=args.shard, truncate=args.truncate)
+        finally:
+            await shard_router.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from core.broadcast import Broadcast, broadcast
+from core.config import settings
+from .notifications import CHANNEL
+
+
+# Rough per-entry bookkeeping cost (dict slot, key, tuple) counted on top of the body.
+ENTRY_OVERHEAD = 200
+
+
+class _Flight:
+    """A listing load in progress; concurrent misses for the same user wait on it."""
+
+    def __init__(self, shard: int):
+        self.shard = shard
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.stale = False
+
+
+class VaultCache:
+    """
+    Byte-bounded LRU of serialized vault listings, keyed by user id and shard.
+
+    The shard is part of the key because entry ids change when a vault moves:
+    once a request sees the user on a new shard, a listing cached from the old
+    one is dropped even if the move's event never reached this worker.
+    Concurrent misses for one user share a single load. Writers call
+    `invalidate` synchronously once their transaction has committed. A load
+    that was already running when the write landed is still returned to the
+    callers waiting on it, but it is not cached, and requests arriving after
+    the write start a fresh load. Other workers drop their copy when the change
+    reaches them through the broadcast backend, on the same channel as the vault
+    change events.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, bus: Optional[Broadcast] = None, channel: str = CHANNEL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[int, bytes, float]] = OrderedDict()
+        self._flights: dict[int, _Flight] = {}
+        if bus is not None:
+            bus.subscribe(channel, self._on_message)
+
+    async def get(self, user_id: int, shard: int, loader: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        Return the cached listing, or load it once for all concurrent callers.
+
+        Args:
+            user_id (int): Owner of the vault.
+            shard (int): Shard the vault is read from.
+            loader (Callable): Coroutine function producing the serialized listing.
+
+        Returns:
+            bytes: The serialized listing.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry_shard, body, expires_at = entry
+            if entry_shard == shard and expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return body
+            self._evict(user_id)
+
+        flight = self._flights.get(user_id)
+        if flight is not None and flight.shard == shard:
+            try:
+                return await asyncio.shield(flight.future)
+            except asyncio.CancelledError:
+                if not flight.future.cancelled():
+                    raise
+                # The request leading the load went away; take over.
+                return await self.get(user_id, shard, loader)
+        if flight is not None:
+            # Still reading the shard the vault moved away from.
+            flight.stale = True
+
+        self.misses += 1
+        flight = self._flights[user_id] = _Flight(shard)
+        try:
+            body = await loader()
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except Exception as e:
+            flight.future.set_exception(e)
+            flight.future.exception()  # waiters re-raise it; don't log it as unretrieved
+            raise
+        finally:
+            if self._flights.get(user_id) is flight:
+                del self._flights[user_id]
+        flight.future.set_result(body)
+        if not flight.stale:
+            self._store(user_id, shard, body)
+        return body
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop a user's listing and detach any load that started before the change."""
+        self._evict(user_id)
+        flight = self._flights.pop(user_id, None)
+        if flight is not None:
+            flight.stale = True
+
+    def _on_message(self, message: dict) -> None:
+        self.invalidate(message["user_id"])
+
+    def _store(self, user_id: int, shard: int, body: bytes) -> None:
+        cost = len(body) + ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+        self._evict(user_id)
+        self._entries[user_id] = (shard, body, time.monotonic() + self.ttl)
+        self.size += cost
+        while self.size > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.size -= len(entry[1]) + ENTRY_OVERHEAD
+
+
+vault_cache = VaultCache(
+    max_bytes=settings.VAULT_CACHE_MAX_BYTES,
+    ttl=settings.VAULT_CACHE_TTL,
+    bus=broadcast if settings.VAULT_CACHE_ENABLED else None,
+)
@@ -1,5 +1,5 @@
-from core.database import Base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from core.database import Base, UTCDateTime
+from sqlalchemy import Column, Integer, String, ForeignKey
 from sqlalchemy.orm import relationship
 from datetime import timezone, datetime
 from auth.models import User
@@ -9,12 +9,56 @@ class Password(Base):
     __tablename__ = "passwords"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     website = Column(String, nullable=False)
     username = Column(String, nullable=False)
     encrypted_password = Column(String, nullable=False)
     iv = Column(String, nullable=False)
-    salt = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
-    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+    # Per-entry PBKDF2 salt; only schema 1 entries have one.
+    salt = Column(String, nullable=True)
+    schema_version = Column(Integer, nullable=False, default=1, server_default="1")
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
     user = relationship("User", back_populates="passwords")
+
+
+class PasswordVersion(Base):
+    __tablename__ = "password_versions"
+
+    # Append-only: a row is the state an entry had before an update or restore replaced it.
+    id = Column(Integer, primary_key=True, index=True)
+    password_id = Column(Integer, ForeignKey("passwords.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    website = Column(String, nullable=False)
+    username = Column(String, nullable=False)
+    encrypted_password = Column(String, nullable=False)
+    iv = Column(String, nullable=False)
+    salt = Column(String, nullable=True)
+    schema_version = Column(Integer, nullable=False, default=1, server_default="1")
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+
+class UserKey(Base):
+    __tablename__ = "user_keys"
+
+    # The user's vault data key, encrypted client-side under a key derived from the
+    # master password. The server never sees either key in the clear.
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True)
+    wrapped_key = Column(String, nullable=False)
+    iv = Column(String, nullable=False)
+    salt = Column(String, nullable=False)
+    kdf_iterations = Column(Integer, nullable=False)
+    key_version = Column(Integer, nullable=False, default=1)
+    created_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(UTCDateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+# Entry encryption schemes: 1 derives a key per entry from the master password and
+# `salt`; 2 encrypts the entry directly under the user's data key from `user_keys`.
+SCHEMA_ENTRY_KEY = 1
+SCHEMA_DATA_KEY = 2
+
+# Tables that live on the user's shard rather than on the primary database,
+# in dependency order.
+VAULT_TABLES = [UserKey.__table__, Password.__table__, PasswordVersion.__table__]
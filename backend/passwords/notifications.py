@@ -0,0 +1,73 @@
+import asyncio
+from collections import defaultdict
+from typing import Optional
+from core.broadcast import broadcast
+from core.config import settings
+
+
+CHANNEL = "vault_events"
+
+
+class Subscriber:
+    """One open event stream: a bounded queue of events for a single session."""
+
+    def __init__(self, user_id: int, client_id: Optional[str], queue_size: int):
+        self.user_id = user_id
+        self.client_id = client_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, event: dict) -> None:
+        """
+        Queue an event without blocking the publisher.
+
+        A client that falls a whole queue behind has its backlog replaced by a
+        single "resync" event telling it to fetch the vault again.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class VaultEventHub:
+    """
+    Fans vault change events out to the open event streams of the affected user.
+
+    Events travel through the broadcast backend, so streams held by other workers
+    see them too; the session that made the change (identified by its client id)
+    is skipped.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[Subscriber]] = defaultdict(set)
+        broadcast.subscribe(CHANNEL, self._deliver)
+
+    def connect(self, user_id: int, client_id: Optional[str]) -> Subscriber:
+        subscriber = Subscriber(user_id, client_id, self.queue_size)
+        self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def disconnect(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+
+    async def publish(self, user_id: int, event_type: str, password_id: Optional[int], origin: Optional[str] = None) -> None:
+        await broadcast.publish(CHANNEL, {
+            "user_id": user_id,
+            "origin": origin,
+            "event": {"type": event_type, "id": password_id},
+        })
+
+    def _deliver(self, message: dict) -> None:
+        for subscriber in list(self._subscribers.get(message["user_id"], ())):
+            if message["origin"] is None or subscriber.client_id != message["origin"]:
+                subscriber.offer(message["event"])
+
+
+vault_events = VaultEventHub(queue_size=settings.EVENTS_QUEUE_SIZE)
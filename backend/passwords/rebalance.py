@@ -0,0 +1,213 @@
+"""
+Move a user's vault between shards while the service keeps running.
+
+Usage (from the backend directory):
+
+    python -m passwords.rebalance locate user@example.com
+    python -m passwords.rebalance move user@example.com 2
+
+While a move runs the user can still read their vault from the source shard;
+writes are answered with 503 and Retry-After until the directory entry in
+`users.shard` points at the target. Rows keep their ids on the target shard, so
+ids a client already holds stay valid. Every shard numbers its rows
+independently, though, so a row whose id is already taken there by another user
+gets a new one, and its version history is re-pointed at it; the old id then
+belongs to someone else and can only answer 404, never reach a different entry
+of the same user. An interrupted move can simply be run again: rows left on the
+target by a previous attempt are cleared first, and the source is only emptied
+after the switch.
+"""
+import argparse
+import asyncio
+import sys
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import select, delete, insert, update, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth.models import User
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.logging_config import logger
+from core.sharding import shard_router
+from passwords import models
+from passwords.notifications import vault_events
+
+
+BATCH_SIZE = 500
+
+
+async def delete_user_rows(db: AsyncSession, table, user_id: int, batch_size: int = BATCH_SIZE,
+                           progress: Optional[Callable[[int], Awaitable[None]]] = None) -> int:
+    """
+    Delete a user's rows from a vault table in chunks, without loading them.
+
+    Args:
+        db (AsyncSession): Session on the shard to clean up.
+        table (Table): Vault table with a user_id column.
+        user_id (int): Owner of the rows.
+        batch_size (int): Rows deleted per statement.
+        progress (Optional[Callable]): Coroutine function awaited with the row count of every committed chunk.
+
+    Returns:
+        int: Number of deleted rows.
+    """
+    total = 0
+    while True:
+        chunk = select(table.c.id).where(table.c.user_id == user_id).limit(batch_size).scalar_subquery()
+        result = await db.execute(delete(table).where(table.c.id.in_(chunk)))
+        await db.commit()
+        if result.rowcount == 0:
+            return total
+        total += result.rowcount
+        if progress is not None:
+            await progress(result.rowcount)
+
+
+async def _reserve_ids(source: AsyncSession, target: AsyncSession, table, user_id: int) -> None:
+    """Move the target's id sequence past the ids about to be copied, so new rows can't take them."""
+    if target.bind.dialect.name != "postgresql":
+        # SQLite numbers new rows after the highest id present; rows are copied highest first.
+        return
+    max_id = (await source.execute(select(func.max(table.c.id)).where(table.c.user_id == user_id))).scalar()
+    if max_id is not None:
+        sequence = f"pg_get_serial_sequence('{table.name}', 'id')"
+        await target.execute(text(f"SELECT setval({sequence}, GREATEST(:max_id, nextval({sequence})))"),
+                             {"max_id": max_id})
+        await target.commit()
+
+
+async def _copy_table(source: AsyncSession, target: AsyncSession, table, user_id: int,
+                      remap: Optional[dict[int, int]] = None) -> dict[int, int]:
+    """
+    Copy a user's rows of one vault table, keeping each id that is free on the target.
+
+    Returns the old-to-new id mapping of the copied rows; `remap` is the mapping
+    of the entries that this table's `password_id` points at.
+    """
+    await _reserve_ids(source, target, table, user_id)
+    ids = {}
+    result = await source.stream(
+        select(table).where(table.c.user_id == user_id).order_by(table.c.id.desc())
+        .execution_options(yield_per=BATCH_SIZE))
+    async for rows in result.mappings().partitions():
+        values = [dict(row) for row in rows]
+        if remap is not None:
+            # History of entries deleted without a cascade has nothing to point at any more.
+            values = [dict(value, password_id=remap[value["password_id"]])
+                      for value in values if value["password_id"] in remap]
+            if not values:
+                continue
+        taken = set((await target.execute(
+            select(table.c.id).where(table.c.id.in_([value["id"] for value in values])))).scalars())
+        kept = [value for value in values if value["id"] not in taken]
+        if kept:
+            await target.execute(insert(table), kept)
+            ids.update((value["id"], value["id"]) for value in kept)
+        renumbered = [value for value in reversed(values) if value["id"] in taken]
+        if renumbered:
+            inserted = await target.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True),
+                [{name: v for name, v in value.items() if name != "id"} for value in renumbered])
+            ids.update(zip((value["id"] for value in renumbered), inserted.scalars()))
+        await target.commit()
+    return ids
+
+
+async def _copy_rows(source: AsyncSession, target: AsyncSession, user_id: int) -> int:
+    await _copy_table(source, target, models.UserKey.__table__, user_id)
+    ids = await _copy_table(source, target, models.Password.__table__, user_id)
+    await _copy_table(source, target, models.PasswordVersion.__table__, user_id, remap=ids)
+    return len(ids)
+
+
+async def delete_vault(db: AsyncSession, user_id: int) -> int:
+    """Delete all of a user's vault rows on one shard, dependent tables first."""
+    total = 0
+    for table in reversed(models.VAULT_TABLES):
+        total += await delete_user_rows(db, table, user_id)
+    return total
+
+
+async def _set_directory(user_id: int, **values) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(User).where(User.id == user_id).values(**values))
+        await db.commit()
+
+
+async def move_user(email: str, target: int) -> int:
+    """
+    Move one user's vault to another shard.
+
+    Args:
+        email (str): The user to move.
+        target (int): Destination shard.
+
+    Raises:
+        SystemExit: If the user or the shard does not exist.
+
+    Returns:
+        int: Number of entries moved.
+    """
+    if not 0 <= target < shard_router.shard_count:
+        raise SystemExit(f"Shard {target} is not configured.")
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
+    if user is None:
+        raise SystemExit(f"No user with email {email}.")
+    source = shard_router.shard_of(user)
+    if source == target:
+        logger.info(f"[REBALANCE] {email} already lives on shard {target}")
+        return 0
+
+    await _set_directory(user.id, vault_moving=True)
+    try:
+        # Give writes that passed the vault_moving check before it flipped time to land.
+        await asyncio.sleep(settings.SHARD_MOVE_GRACE)
+        async with shard_router.session(target) as dst:
+            await delete_vault(dst, user.id)
+            async with shard_router.session(source) as src:
+                moved = await _copy_rows(src, dst, user.id)
+        await _set_directory(user.id, shard=target, vault_moving=False)
+    except BaseException:
+        await _set_directory(user.id, vault_moving=False)
+        raise
+    # Some entries may have been renumbered: open sessions must fetch the vault again.
+    await vault_events.publish(user.id, "resync", None)
+
+    async with shard_router.session(source) as src:
+        await delete_vault(src, user.id)
+    logger.info(f"[REBALANCE] Moved {moved} entries of {email} from shard {source} to shard {target}")
+    return moved
+
+
+async def locate(email: str) -> None:
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
+    if user is None:
+        raise SystemExit(f"No user with email {email}.")
+    print(f"{email}: shard {shard_router.shard_of(user)}{' (moving)' if user.vault_moving else ''}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect and move users between vault shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    locate_cmd = commands.add_parser("locate", help="Show which shard holds a user's vault.")
+    locate_cmd.add_argument("email")
+    move_cmd = commands.add_parser("move", help="Move a user's vault to another shard.")
+    move_cmd.add_argument("email")
+    move_cmd.add_argument("shard", type=int)
+    args = parser.parse_args(argv)
+
+    async def run():
+        try:
+            if args.command == "locate":
+                await locate(args.email)
+            else:
+                await move_user(args.email, args.shard)
+        finally:
+            await shard_router.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
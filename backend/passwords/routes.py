@@ -1,83 +1,319 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Header, Request
+from fastapi.responses import StreamingResponse, Response
+from pydantic import TypeAdapter
 from . import schemas
-from core.database import get_db
+from . import export
+from . import versions
+from .notifications import vault_events
+from .cache import vault_cache
 from fastapi.params import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from passwords import models
-from core.dependencies import get_current_user
-from sqlalchemy import select
+from core.dependencies import get_current_user, get_vault_db, get_writable_vault_db
+from core import repository
+from core.sharding import shard_router
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from audit.writer import audit_writer
+from core.config import settings
 
 
 router = APIRouter(prefix="/passwords", tags=["Password Fetch Routes"])
+vault_listing = TypeAdapter(list[schemas.PasswordOut])
+
+
+async def _require_vault_key(db: AsyncSession, user_id: int, schema_version: int) -> None:
+    # A data-key entry without a wrapped key to decrypt it could never be read again.
+    if schema_version == models.SCHEMA_DATA_KEY and await repository.get_vault_key(db, user_id) is None:
+        raise HTTPException(status_code=409, detail="Create a vault key before storing data-key entries")
 
 
 @router.post("/add-password", response_model=schemas.Message)
-async def add_password(data: schemas.PasswordCreate, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+async def add_password(
+    data: schemas.PasswordCreate,
+    db: AsyncSession = Depends(get_writable_vault_db),
+    user=Depends(get_current_user),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
     """
     Route to add a new password.
     """
+    await _require_vault_key(db, user.id, data.schema_version)
     new_password = models.Password(
         website=data.website,
         username=data.username,
         encrypted_password=data.encrypted_password,
         iv=data.iv,
-        salt=data.salt
+        salt=data.salt,
+        schema_version=data.schema_version
     )
     new_password.user_id = user.id
     db.add(new_password)
     await db.commit()
+    vault_cache.invalidate(user.id)
     await db.refresh(new_password)
+    await audit_writer.record("password_add", user_id=user.id, target_id=new_password.id)
+    await vault_events.publish(user.id, "password_added", new_password.id, origin=client_id)
     return {"message": "Password added successfully."}
 
 
 @router.get("/get-passwords", response_model=list[schemas.PasswordOut])
-async def get_passwords(db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+async def get_passwords(db: AsyncSession = Depends(get_vault_db), user=Depends(get_current_user)):
     """
     Route to get all passwords for the current user.
     """
-    query = select(models.Password).where(models.Password.user_id == user.id)
-    passwords = await db.execute(query)
-    return passwords.scalars().all()
+    async def load() -> bytes:
+        passwords = await repository.list_passwords(db, user.id)
+        return vault_listing.dump_json(vault_listing.validate_python(passwords, from_attributes=True))
+
+    if settings.VAULT_CACHE_ENABLED:
+        body = await vault_cache.get(user.id, shard_router.shard_of(user), load)
+    else:
+        body = await load()
+    return Response(content=body, media_type="application/json")
+
+
+@router.get("/export")
+async def export_passwords(format: str = Query("ndjson", pattern="^(ndjson|zip)$"), user=Depends(get_current_user)):
+    """
+    Route to stream the current user's encrypted vault as NDJSON or a zip archive.
+    """
+    await audit_writer.record("vault_export", user_id=user.id)
+    if format == "zip":
+        return StreamingResponse(
+            export.zip_stream(user),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="vault-export.zip"'},
+        )
+    return StreamingResponse(
+        export.ndjson_lines(user),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="vault-export.ndjson"'},
+    )
+
+
+@router.get("/events")
+async def vault_event_stream(request: Request, client_id: Optional[str] = None, user=Depends(get_current_user)):
+    """
+    Route to receive server-sent events whenever the current user's vault changes
+    in another session. Pass the same `client_id` here and as the `X-Client-Id`
+    header on writes so a session is not notified of its own changes.
+    """
+    async def stream():
+        subscriber = vault_events.connect(user.id, client_id)
+        try:
+            yield f"retry: {int(settings.EVENTS_HEARTBEAT * 1000)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=settings.EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            vault_events.disconnect(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/key", response_model=schemas.VaultKeyOut)
+async def get_vault_key(db: AsyncSession = Depends(get_vault_db), user=Depends(get_current_user)):
+    """
+    Route to fetch the current user's wrapped vault data key, along with the number
+    of entries still encrypted with a per-entry key.
+    """
+    key = await repository.get_vault_key(db, user.id)
+    if not key:
+        raise HTTPException(status_code=404, detail="Vault key not found")
+    return {
+        "wrapped_key": key.wrapped_key,
+        "iv": key.iv,
+        "salt": key.salt,
+        "kdf_iterations": key.kdf_iterations,
+        "key_version": key.key_version,
+        "pending_entries": await repository.count_pending_entries(db, user.id),
+    }
+
+
+@router.put("/key", response_model=schemas.Message)
+async def put_vault_key(
+    data: schemas.VaultKeyIn,
+    db: AsyncSession = Depends(get_writable_vault_db),
+    user=Depends(get_current_user),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
+    """
+    Route to store the wrapped vault data key, or to re-wrap it (after a master
+    password change) with `key_version` set to the version being replaced.
+    The data key itself must stay the same, since entries are encrypted under it.
+    """
+    values = {
+        "wrapped_key": data.wrapped_key,
+        "iv": data.iv,
+        "salt": data.salt,
+        "kdf_iterations": data.kdf_iterations,
+    }
+    if data.key_version is None:
+        db.add(models.UserKey(user_id=user.id, key_version=1, **values))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Vault key already exists")
+        action, message = "vault_key_create", "Vault key created."
+    else:
+        # Compare-and-set on the version, so two sessions re-wrapping at once cannot
+        # silently overwrite each other's key.
+        query = (
+            update(models.UserKey)
+            .where(models.UserKey.user_id == user.id, models.UserKey.key_version == data.key_version)
+            .values(key_version=models.UserKey.key_version + 1, **values)
+        )
+        result = await db.execute(query)
+        if result.rowcount == 0:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Vault key has changed, fetch it again")
+        await db.commit()
+        action, message = "vault_key_rotate", "Vault key rotated."
+
+    await audit_writer.record(action, user_id=user.id)
+    await vault_events.publish(user.id, "key_rotated", None, origin=client_id)
+    return {"message": message}
+
+
+@router.post("/migrate", response_model=schemas.MigrationResult)
+async def migrate_passwords(
+    batch: schemas.MigrationBatch,
+    db: AsyncSession = Depends(get_writable_vault_db),
+    user=Depends(get_current_user),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
+    """
+    Route to move a batch of entries from per-entry keys to the vault data key.
+    The client decrypts each entry as before and sends it back encrypted under the
+    data key; ids that are unknown or already migrated are skipped, so a batch can
+    be retried safely.
+    """
+    if await repository.get_vault_key(db, user.id) is None:
+        raise HTTPException(status_code=409, detail="Create a vault key before migrating entries")
+
+    entries = {entry.id: entry for entry in batch.entries}
+    query = select(models.Password.id).where(
+        models.Password.id.in_(entries),
+        models.Password.user_id == user.id,
+        models.Password.schema_version == models.SCHEMA_ENTRY_KEY,
+    )
+    ids = (await db.execute(query)).scalars().all()
+    if ids:
+        # Keep the per-entry ciphertexts, so a bad re-encryption can be rolled back.
+        await versions.snapshot_many(db, ids, user.id)
+        await db.execute(update(models.Password), [
+            {
+                "id": id,
+                "encrypted_password": entries[id].encrypted_password,
+                "iv": entries[id].iv,
+                "salt": None,
+                "schema_version": models.SCHEMA_DATA_KEY,
+            }
+            for id in ids
+        ])
+        await db.commit()
+        vault_cache.invalidate(user.id)
+        await audit_writer.record("vault_migrate", user_id=user.id)
+        await vault_events.publish(user.id, "vault_migrated", None, origin=client_id)
+    return {"migrated": len(ids), "remaining": await repository.count_pending_entries(db, user.id)}
 
 
 @router.put("/{id}", response_model=schemas.Message)
 async def update_password(
     id: int,
     payload: schemas.PasswordCreate,
-    db: AsyncSession = Depends(get_db),
-    user=Depends(get_current_user)
+    db: AsyncSession = Depends(get_writable_vault_db),
+    user=Depends(get_current_user),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
 ):
-    query = select(models.Password).where(models.Password.id == id, models.Password.user_id == user.id)
-    result = await db.execute(query)
-    password = result.scalar_one_or_none()
+    password = await repository.get_password(db, id, user.id)
     if not password:
         raise HTTPException(status_code=404, detail="Password not found")
+    await _require_vault_key(db, user.id, payload.schema_version)
 
+    await versions.snapshot(db, password_id=id, user_id=user.id)
     password.website = payload.website
     password.username = payload.username
     password.encrypted_password = payload.encrypted_password
     password.iv = payload.iv
     password.salt = payload.salt
+    password.schema_version = payload.schema_version
 
     await db.commit()
+    vault_cache.invalidate(user.id)
     await db.refresh(password)
+    await audit_writer.record("password_update", user_id=user.id, target_id=id)
+    await vault_events.publish(user.id, "password_updated", id, origin=client_id)
     return {"message": "Password updated successfully."}
 
 
+@router.get("/{id}/versions", response_model=list[schemas.PasswordVersionOut])
+async def get_password_versions(id: int, db: AsyncSession = Depends(get_vault_db), user=Depends(get_current_user)):
+    """
+    Route to list the previous versions of an entry, newest first.
+    """
+    return await repository.list_versions(db, id, user.id)
+
+
+@router.post("/{id}/versions/{version_id}/restore", response_model=schemas.Message)
+async def restore_password_version(
+    id: int,
+    version_id: int,
+    db: AsyncSession = Depends(get_writable_vault_db),
+    user=Depends(get_current_user),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
+    """
+    Route to roll an entry back to one of its previous versions.
+    The state being replaced is kept as a new version, so a restore can itself be undone.
+    """
+    password = await repository.get_password(db, id, user.id)
+    version = await repository.get_version(db, version_id, id, user.id)
+    if not password or not version:
+        raise HTTPException(status_code=404, detail="Password version not found")
+    await _require_vault_key(db, user.id, version.schema_version)
+
+    await versions.snapshot(db, password_id=id, user_id=user.id)
+    password.website = version.website
+    password.username = version.username
+    password.encrypted_password = version.encrypted_password
+    password.iv = version.iv
+    password.salt = version.salt
+    password.schema_version = version.schema_version
+
+    await db.commit()
+    vault_cache.invalidate(user.id)
+    await audit_writer.record("password_restore", user_id=user.id, target_id=id)
+    await vault_events.publish(user.id, "password_updated", id, origin=client_id)
+    return {"message": "Password restored successfully."}
+
+
 @router.delete("/{id}", response_model=schemas.Message)
 async def delete_password(
     id: int,
-    db: AsyncSession = Depends(get_db),
-    user=Depends(get_current_user)
+    db: AsyncSession = Depends(get_writable_vault_db),
+    user=Depends(get_current_user),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
 ):
-    query = select(models.Password).where(models.Password.id == id, models.Password.user_id == user.id)
-    result = await db.execute(query)
-    password = result.scalar_one_or_none()
+    password = await repository.get_password(db, id, user.id)
 
     if not password:
         raise HTTPException(status_code=404, detail="Password not found")
 
     await db.delete(password)
     await db.commit()
+    vault_cache.invalidate(user.id)
+    await audit_writer.record("password_delete", user_id=user.id, target_id=id)
+    await vault_events.publish(user.id, "password_deleted", id, origin=client_id)
 
     return {"message": "Password deleted"}
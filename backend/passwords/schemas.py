@@ -1,4 +1,7 @@
-from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from core.config import settings
 
 
 class PasswordCreate(BaseModel):
@@ -6,7 +9,16 @@ class PasswordCreate(BaseModel):
     username: str
     encrypted_password: str
     iv: str
-    salt: str
+    salt: Optional[str] = None
+    schema_version: int = Field(1, ge=1, le=2)
+
+    @model_validator(mode="after")
+    def validate_salt(self):
+        if self.schema_version == 1 and not self.salt:
+            raise ValueError("Entries encrypted with a per-entry key (schema_version 1) need a salt.")
+        if self.schema_version == 2:
+            self.salt = None
+        return self
 
 
 class PasswordOut(BaseModel):
@@ -15,7 +27,56 @@ class PasswordOut(BaseModel):
     username: str
     encrypted_password: str
     iv: str
+    salt: Optional[str]
+    schema_version: int
+
+
+class PasswordVersionOut(BaseModel):
+    id: int
+    website: str
+    username: str
+    encrypted_password: str
+    iv: str
+    salt: Optional[str]
+    schema_version: int
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class VaultKeyIn(BaseModel):
+    wrapped_key: str
+    iv: str
     salt: str
+    kdf_iterations: int = Field(..., ge=100000)
+    # Version the client last saw; omit when creating the first key.
+    key_version: Optional[int] = None
+
+
+class VaultKeyOut(BaseModel):
+    wrapped_key: str
+    iv: str
+    salt: str
+    kdf_iterations: int
+    key_version: int
+    pending_entries: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReencryptedEntry(BaseModel):
+    id: int
+    encrypted_password: str
+    iv: str
+
+
+class MigrationBatch(BaseModel):
+    entries: list[ReencryptedEntry] = Field(..., min_length=1, max_length=settings.VAULT_MIGRATION_BATCH)
+
+
+class MigrationResult(BaseModel):
+    migrated: int
+    remaining: int
 
 
 class Message(BaseModel):
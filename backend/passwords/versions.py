@@ -0,0 +1,132 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select, insert, delete, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.config import settings
+from core.database import UTCDateTime
+from core.logging_config import logger
+from core.sharding import shard_router
+from passwords import models
+
+
+SNAPSHOT_COLUMNS = ["password_id", "user_id", "website", "username", "encrypted_password", "iv", "salt",
+                    "schema_version", "created_at"]
+
+
+async def snapshot(db: AsyncSession, password_id: int, user_id: int) -> None:
+    """
+    Append the current state of an entry to its history with a single INSERT ... SELECT.
+
+    Args:
+        db (AsyncSession): Session on the user's shard; the caller commits.
+        password_id (int): The entry about to be overwritten.
+        user_id (int): Owner of the entry.
+    """
+    await snapshot_many(db, [password_id], user_id)
+
+
+async def snapshot_many(db: AsyncSession, password_ids: list[int], user_id: int) -> None:
+    """Like `snapshot`, for a batch of entries in the same statement."""
+    p = models.Password
+    current = select(
+        p.id, p.user_id, p.website, p.username, p.encrypted_password, p.iv, p.salt, p.schema_version,
+        literal(datetime.now(timezone.utc), UTCDateTime),
+    ).where(p.id.in_(password_ids), p.user_id == user_id)
+    await db.execute(insert(models.PasswordVersion).from_select(SNAPSHOT_COLUMNS, current))
+
+
+async def _delete_batches(db: AsyncSession, chunk) -> int:
+    total = 0
+    while True:
+        result = await db.execute(delete(models.PasswordVersion).where(models.PasswordVersion.id.in_(chunk)))
+        await db.commit()
+        if result.rowcount == 0:
+            return total
+        total += result.rowcount
+        await asyncio.sleep(0)
+
+
+async def _delete_ids(db: AsyncSession, ids: list[int]) -> int:
+    result = await db.execute(delete(models.PasswordVersion).where(models.PasswordVersion.id.in_(ids)))
+    await db.commit()
+    await asyncio.sleep(0)
+    return result.rowcount
+
+
+async def prune(db: AsyncSession, keep_versions: int, keep_days: int, batch_size: int) -> int:
+    """
+    Enforce the retention policy on one shard, deleting at most `batch_size` rows per statement.
+
+    Args:
+        db (AsyncSession): Session on the shard to prune.
+        keep_versions (int): Versions kept per entry; 0 keeps all.
+        keep_days (int): Age in days after which versions are dropped; 0 keeps all.
+        batch_size (int): Rows deleted per statement.
+
+    Returns:
+        int: Number of deleted versions.
+    """
+    v = models.PasswordVersion
+    deleted = 0
+    if keep_days:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=keep_days)
+        chunk = select(v.id).where(v.created_at < cutoff).limit(batch_size).scalar_subquery()
+        deleted += await _delete_batches(db, chunk)
+    if keep_versions:
+        # One aggregate pass finds the entries over the limit; each entry's surplus
+        # is then read through the password_id index and deleted in batches.
+        over_limit = select(v.password_id).group_by(v.password_id).having(func.count() > keep_versions)
+        password_ids = (await db.execute(over_limit)).scalars().all()
+        pending: list[int] = []
+        for password_id in password_ids:
+            surplus = select(v.id).where(v.password_id == password_id).order_by(v.id.desc()).offset(keep_versions)
+            pending.extend((await db.execute(surplus)).scalars())
+            while len(pending) >= batch_size:
+                deleted += await _delete_ids(db, pending[:batch_size])
+                del pending[:batch_size]
+        if pending:
+            deleted += await _delete_ids(db, pending)
+    return deleted
+
+
+class VersionPruner:
+    """Background task applying the version retention policy to every shard."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        deleted = 0
+        for shard in range(shard_router.shard_count):
+            async with shard_router.session(shard) as db:
+                deleted += await prune(db, settings.VERSION_RETENTION_COUNT,
+                                       settings.VERSION_RETENTION_DAYS, settings.VERSION_PRUNE_BATCH)
+        if deleted:
+            logger.info(f"[VERSIONS] Pruned {deleted} old entry versions")
+        return deleted
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"[VERSIONS] Pruning failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+version_pruner = VersionPruner(interval=settings.VERSION_PRUNE_INTERVAL)
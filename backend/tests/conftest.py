@@ -0,0 +1,58 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+import pytest
+
+# Settings are read at import time, so point them at a throwaway SQLite database
+# before the app is imported. Background flushes and syncs are pushed out of the
+# way so they don't add statements to a test's query budget.
+_db_dir = tempfile.mkdtemp(prefix="pass-vault-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_db_dir}/test.db",
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "URL": "http://testserver",
+    "SMTP_SERVER": "localhost",
+    "SMTP_PORT": "25",
+    "EMAIL_FROM": "noreply@example.com",
+    "SMTP_PASSWORD": "unused",
+    "AUDIT_FLUSH_INTERVAL": "3600",
+    "REVOCATION_SYNC_INTERVAL": "3600",
+    "VERSION_PRUNE_INTERVAL": "3600",
+    "ADMISSION_ENABLED": "false",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from main import app  # noqa: E402
+
+
+PASSWORD = "Passw0rd!"
+ENTRY = {"website": "example.com", "username": "alice", "encrypted_password": "ciphertext", "iv": "iv",
+         "salt": "salt"}
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app, base_url="https://testserver") as test_client:
+        yield test_client
+    shutil.rmtree(_db_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def email(client) -> str:
+    """A freshly signed-up user."""
+    address = f"user-{uuid.uuid4().hex[:12]}@example.com"
+    response = client.post("/auth/signup", json={"email": address, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    return address
+
+
+@pytest.fixture
+def auth(client, email) -> dict:
+    """Authorization headers of a signed-in user."""
+    response = client.post("/auth/signin", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
@@ -0,0 +1,46 @@
+"""
+Statement budgets of the hot endpoints.
+
+Each budget is the number of statements the endpoint issues today, counting the
+user lookup of `get_current_user`; a change that adds a query fails here and
+lists every statement the request ran.
+"""
+from core.query_stats import query_budget
+from conftest import ENTRY, PASSWORD
+
+
+def _add_entry(client, auth) -> int:
+    assert client.post("/passwords/add-password", json=ENTRY, headers=auth).status_code == 200
+    return client.get("/passwords/get-passwords", headers=auth).json()[-1]["id"]
+
+
+def test_signin(client, email):
+    # The user lookup; the refresh token is issued without touching the database.
+    with query_budget(1):
+        response = client.post("/auth/signin", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200
+
+
+def test_get_passwords(client, auth):
+    _add_entry(client, auth)
+    # User lookup and the listing.
+    with query_budget(2):
+        response = client.get("/passwords/get-passwords", headers=auth)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+def test_add_password(client, auth):
+    # User lookup, the INSERT and the refresh() re-SELECT of the new row.
+    with query_budget(3):
+        response = client.post("/passwords/add-password", json=ENTRY, headers=auth)
+    assert response.status_code == 200
+
+
+def test_update_password(client, auth):
+    entry_id = _add_entry(client, auth)
+    # User lookup, entry lookup, version snapshot (INSERT ... SELECT), the UPDATE and
+    # the refresh() re-SELECT.
+    with query_budget(5):
+        response = client.put(f"/passwords/{entry_id}", json=dict(ENTRY, website="example.org"), headers=auth)
+    assert response.status_code == 200